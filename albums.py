@@ -0,0 +1,45 @@
+import threading
+
+# Telegram присылает альбом пачкой отдельных сообщений с общим media_group_id
+ALBUM_WINDOW = 1.5
+
+
+class AlbumCollector:
+    # Копит части альбома и отдаёт их одним списком, когда ALBUM_WINDOW секунд не приходит новых частей.
+    # Окно сдвигается с каждой частью: части одного пользователя обрабатываются по очереди, и при медленном
+    # API последняя может дойти сюда намного позже первой
+    def __init__(self, job_queue, on_complete, window=ALBUM_WINDOW):
+        self._job_queue = job_queue
+        self._on_complete = on_complete
+        self._window = window
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def add(self, update, item, caption=None):
+        key = (update.effective_user.id, update.message.media_group_id)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = {'update': update, 'items': [], 'caption': None, 'job': None}
+                self._groups[key] = group
+            if group['job'] is not None:
+                group['job'].schedule_removal()
+            group['job'] = self._job_queue.run_once(self._flush, self._window, context=key)
+            group['items'].append((update.message.message_id, item))
+            if caption and not group['caption']:
+                group['caption'] = caption
+
+    def _flush(self, context):
+        with self._lock:
+            group = self._groups.get(context.job.context)
+            # окно уже сдвинула следующая часть
+            if not group or group['job'] is not context.job:
+                return
+            del self._groups[context.job.context]
+        # части могут прийти не по порядку
+        items = [item for _, item in sorted(group['items'], key=lambda pair: pair[0])]
+        self._on_complete(group['update'], context, items, group['caption'])
+
+    def pending(self):
+        with self._lock:
+            return len(self._groups)
@@ -0,0 +1,168 @@
+import os
+import json
+import zlib
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+from sqlhelper import Post, Attachment, ModerationMessage, MediaHash, OutboxEntry, ArchiveSegment, ArchivedPost
+
+RESOLVED_STATUSES = ('published', 'declined', 'duplicate')
+# постов в одном сегменте: крупнее — лучше сжатие, мельче — быстрее распаковка при поиске
+SEGMENT_POSTS = 1000
+# сколько сегментов за один проход, чтобы задача не занимала очередь задач надолго
+MAX_SEGMENTS_PER_RUN = 20
+CACHED_SEGMENTS = 8
+
+logger = logging.getLogger('predlozhka.archive')
+
+
+def _record(post, attachments):
+    return {
+        'post_id': post.post_id,
+        'tenant_id': post.tenant_id,
+        'owner_id': post.owner_id,
+        'status': post.status,
+        'created_at': post.created_at.isoformat() if post.created_at else None,
+        'text': post.text,
+        'media_type': post.media_type,
+        'file_id': post.file_id,
+        'duplicate_of': post.duplicate_of,
+        'attachments': [{'file_id': a.file_id, 'media_type': a.media_type} for a in attachments],
+    }
+
+
+class PostArchive:
+    # Решённые посты старше days дней переезжают из posts в сжатые файлы-сегменты в каталоге root,
+    # по которым можно искать через оглавление archived_posts. В базе остаются только оглавление
+    # и описание сегментов, поэтому она не растёт вместе с архивом. Сегмент сначала целиком пишется
+    # на диск, а потом одной транзакцией добавляются его строки и удаляются посты с их карточками,
+    # вложениями и хэшами: пост не теряется и не двоится. Файлы в temp/ у решённых постов к этому
+    # времени уже удалила очистка temp/
+    def __init__(self, root='archive', days=30, segment_posts=SEGMENT_POSTS, max_segments=MAX_SEGMENTS_PER_RUN):
+        self.root = root
+        self.days = days
+        self.segment_posts = segment_posts
+        self.max_segments = max_segments
+
+        self._lock = threading.Lock()
+        self._segments = OrderedDict()
+        self.archived = 0
+        self.searches = 0
+
+    def run(self, db):
+        # сколько постов перенесено за этот проход
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.days)
+        # самый новый пост не трогаем никогда: SQLite без AUTOINCREMENT выдаёт следующий id как max + 1,
+        # и после удаления последних постов номера пошли бы по второму кругу
+        newest = db.query(func.max(Post.post_id)).scalar()
+        total = 0
+        for _ in range(self.max_segments):
+            posts = db.query(Post) \
+                .filter(Post.status.in_(RESOLVED_STATUSES), Post.created_at < cutoff, Post.post_id < newest) \
+                .order_by(Post.post_id).limit(self.segment_posts).all()
+            if not posts:
+                break
+            self._archive(db, posts)
+            total += len(posts)
+            if len(posts) < self.segment_posts:
+                break
+        if total:
+            with self._lock:
+                self.archived += total
+        return total
+
+    def _archive(self, db, posts):
+        ids = [p.post_id for p in posts]
+        attachments = {}
+        for a in db.query(Attachment).filter(Attachment.post_id.in_(ids)).order_by(Attachment.position):
+            attachments.setdefault(a.post_id, []).append(a)
+
+        raw = '\n'.join(json.dumps(_record(p, attachments.get(p.post_id, [])), ensure_ascii=False)
+                        for p in posts).encode()
+        data = zlib.compress(raw, 9)
+        name = '{}-{}.jsonl.z'.format(ids[0], ids[-1])
+        self._write(name, data)
+        try:
+            segment = ArchiveSegment(ids[0], ids[-1], len(posts), len(raw), name, len(data))
+            db.add(segment)
+            db.flush()
+            db.add_all(ArchivedPost(p.post_id, p.tenant_id, p.owner_id, p.status, p.created_at,
+                                    segment.segment_id) for p in posts)
+
+            for model in (Attachment, ModerationMessage, MediaHash, OutboxEntry):
+                db.query(model).filter(model.post_id.in_(ids)).delete(synchronize_session=False)
+            db.query(Post).filter(Post.post_id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            # посты остались в posts, файл без строки в базе никому не нужен
+            db.rollback()
+            os.remove(os.path.join(self.root, name))
+            raise
+        logger.info('Archived %s posts (%s-%s) into %s, %s -> %s bytes',
+                    len(posts), ids[0], ids[-1], name, len(raw), len(data))
+
+    def _write(self, name, data):
+        # сегмент появляется на диске целиком или не появляется вовсе
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _segment(self, db, segment_id):
+        # post_id -> запись; несколько последних распакованных сегментов держим в памяти
+        with self._lock:
+            records = self._segments.get(segment_id)
+            if records is not None:
+                self._segments.move_to_end(segment_id)
+                return records
+        path = db.query(ArchiveSegment.path).filter_by(segment_id=segment_id).scalar()
+        with open(os.path.join(self.root, path), 'rb') as f:
+            data = f.read()
+        records = {}
+        for line in zlib.decompress(data).decode().splitlines():
+            record = json.loads(line)
+            records[record['post_id']] = record
+        with self._lock:
+            self._segments[segment_id] = records
+            while len(self._segments) > CACHED_SEGMENTS:
+                self._segments.popitem(last=False)
+        return records
+
+    def find(self, db, tenant_id, owner_id=None, since=None, until=None, limit=20):
+        # записи архивных постов канала, новые первыми; распаковываются только нужные сегменты
+        query = db.query(ArchivedPost.post_id, ArchivedPost.segment_id).filter(ArchivedPost.tenant_id == tenant_id)
+        if owner_id is not None:
+            query = query.filter(ArchivedPost.owner_id == owner_id)
+        if since is not None:
+            query = query.filter(ArchivedPost.created_at >= since)
+        if until is not None:
+            query = query.filter(ArchivedPost.created_at < until)
+        rows = query.order_by(ArchivedPost.created_at.desc(), ArchivedPost.post_id.desc()).limit(limit).all()
+        with self._lock:
+            self.searches += 1
+        return [self._segment(db, row.segment_id)[row.post_id] for row in rows]
+
+    def stats(self, db):
+        segments, posts, raw_bytes, stored_bytes = db.query(
+            func.count(ArchiveSegment.segment_id), func.coalesce(func.sum(ArchiveSegment.posts), 0),
+            func.coalesce(func.sum(ArchiveSegment.raw_bytes), 0),
+            func.coalesce(func.sum(ArchiveSegment.stored_bytes), 0)).one()
+        with self._lock:
+            return {
+                'days': self.days,
+                'root': self.root,
+                'segments': segments,
+                'posts': posts,
+                'raw_bytes': raw_bytes,
+                'stored_bytes': stored_bytes,
+                'archived': self.archived,
+                'searches': self.searches,
+                'cached_segments': len(self._segments),
+            }
@@ -0,0 +1,215 @@
+import os
+import re
+import sys
+import time
+import shutil
+import threading
+import argparse
+import tempfile
+
+from sqlalchemy import event
+from telegram import Update
+
+import main
+from fakebot import FakeBot, MB, dir_size
+from sender import SendScheduler
+from sqlhelper import User, Tenant, TenantMember
+from webhook import FakeTelegramClient
+
+# Прогон обработчиков main.py на FakeBot без Telegram.
+# Пример: python bench.py text_flood albums --latency 0.1 --retry-after-rate 0.02
+
+SCENARIOS = {
+    'text_flood': {'submissions': 500, 'admins': 3, 'kind': 'text'},
+    'large_video': {'submissions': 10, 'admins': 3, 'kind': 'video', 'file_size': 50 * MB},
+    'many_admins': {'submissions': 50, 'admins': 50, 'kind': 'photo'},
+    'albums': {'submissions': 30, 'admins': 3, 'kind': 'album', 'album_size': 5},
+    # один процесс на 20 каналов: у каждого свои админы, авторы пишут в свой канал
+    'channels': {'submissions': 400, 'admins': 2, 'kind': 'text', 'tenants': 20},
+}
+
+ADMIN_BASE = 1000
+OWNER_BASE = 100000
+OWNER_RE = re.compile(r'🆔 (\d+)')
+
+
+def _media_fields(kind, n):
+    file_id = 'bench-{}-{}'.format(kind, n)
+    if kind == 'photo':
+        return {'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960}]}
+    if kind == 'video':
+        return {'video': {'file_id': file_id, 'file_unique_id': file_id, 'width': 1920, 'height': 1080,
+                          'duration': 60, 'file_name': file_id + '.mp4'}}
+    raise ValueError(kind)
+
+
+def build_updates(client, kind, submissions, album_size=1):
+    # список отправок; каждая — список апдейтов (у альбома их несколько)
+    batches = []
+    for i in range(submissions):
+        owner = OWNER_BASE + i
+        if kind == 'text':
+            batches.append([client.message(owner, 'Предложка номер {}'.format(i))])
+        elif kind == 'album':
+            group = 'album-{}'.format(i)
+            batches.append([client.message(owner, media_group_id=group,
+                                           caption='Альбом {}'.format(i) if j == 0 else None,
+                                           **_media_fields('photo', i * album_size + j))
+                            for j in range(album_size)])
+        else:
+            batches.append([client.message(owner, caption='Пост {}'.format(i), **_media_fields(kind, i))])
+    return batches
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[k]
+
+
+def run_scenario(name, cfg, args):
+    workdir = tempfile.mkdtemp(prefix='predlozhka-bench-')
+    tenants = cfg.get('tenants', 1)
+    # у канала t админы ADMIN_BASE + t * admins ...
+    channel_admins = [[ADMIN_BASE + t * cfg['admins'] + i for i in range(cfg['admins'])] for t in range(tenants)]
+    admins = [admin_id for group in channel_admins for admin_id in group]
+    fake = FakeBot(latency=args.latency, upload_bandwidth=args.upload_mbps * MB,
+                   download_bandwidth=args.download_mbps * MB, retry_after_rate=args.retry_after_rate,
+                   file_size=cfg.get('file_size', args.file_size_kb * 1024), flaky_chats=set(admins))
+
+    main.USE_FILE_ID = not args.download
+    if args.download:
+        # файлы больше 20 МБ Bot API отдаёт только через локальный сервер — считаем, что он есть
+        main.MAX_FILE_MB = max(main.MAX_FILE_MB, cfg.get('file_size', 0) // MB + 1)
+    dispatcher = main.init(bot_instance=fake, db_url='sqlite:///{}'.format(os.path.join(workdir, 'bench.db')),
+                           temp_dir=os.path.join(workdir, 'temp'))
+    if not args.real_limits:
+        # настоящие лимиты Telegram (1 сообщение в секунду в чат) превращают замер в замер лимитера
+        main.sender.shutdown()
+        main.sender = SendScheduler(workers=main.SEND_WORKERS, global_rate=10 ** 6, chat_rate=10 ** 6,
+                                    chat_burst=10 ** 6, backoff=0.01)
+
+    db_time = [0.0, 0]
+
+    @event.listens_for(main.engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('bench_start', []).append(time.perf_counter())
+
+    @event.listens_for(main.engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        db_time[0] += time.perf_counter() - conn.info['bench_start'].pop()
+        db_time[1] += 1
+
+    db = main.Session()
+    for t, group in enumerate(channel_admins, start=1):
+        db.add(Tenant('bench{}'.format(t), '@bench_channel_{}'.format(t), group[0], initialized=True, tenant_id=t))
+        db.flush()
+        db.add_all(TenantMember(t, admin_id, is_admin=True) for admin_id in group)
+    # автор i пишет в канал i % tenants, как будто пришёл по ссылке t.me/<бот>?start=bench<N>
+    if tenants > 1:
+        db.add_all(User(OWNER_BASE + i, tenant_id=i % tenants + 1) for i in range(cfg['submissions']))
+    db.commit()
+    main.Session.remove()
+    main.tenant_cache.invalidate()
+
+    client = FakeTelegramClient(None)
+    batches = build_updates(client, cfg['kind'], cfg['submissions'], cfg.get('album_size', 1))
+    expected = cfg['submissions'] * cfg['admins']
+    admin_set = set(admins)
+
+    # обработчики выполняются в пуле потоков диспетчера, его запускает dispatcher.start()
+    threading.Thread(target=dispatcher.start, daemon=True).start()
+    dispatcher.job_queue.start()
+    submitted_at = {}
+    db_before = db_time[:]
+    started = time.monotonic()
+    for i, batch in enumerate(batches):
+        submitted_at[OWNER_BASE + i] = time.monotonic()
+        for data in batch:
+            dispatcher.process_update(Update.de_json(data, fake))
+    ingested = time.monotonic()
+
+    delivered = {}
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        for ts, chat_id, text in list(fake.deliveries):
+            match = OWNER_RE.search(text or '')
+            if chat_id in admin_set and match:
+                delivered[(int(match.group(1)), chat_id)] = ts
+        if len(delivered) >= expected:
+            break
+        time.sleep(0.05)
+
+    latencies = [ts - submitted_at[owner] for (owner, _), ts in delivered.items() if owner in submitted_at]
+    finished = max(delivered.values()) if delivered else time.monotonic()
+    elapsed = max(finished - started, 1e-9)
+
+    result = {
+        'scenario': name,
+        'submissions': cfg['submissions'],
+        'admins': cfg['admins'],
+        'tenants': tenants,
+        'delivered': '{}/{}'.format(len(delivered), expected),
+        'subs_per_sec': cfg['submissions'] / elapsed,
+        'ingest_sec': ingested - started,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'db_ms': (db_time[0] - db_before[0]) * 1000,
+        'db_queries': db_time[1] - db_before[1],
+        'temp_written_mb': fake.downloaded_bytes / MB,
+        'temp_size_mb': dir_size(os.path.join(workdir, 'temp')) / MB,
+        'uploaded_mb': fake.uploaded_bytes / MB,
+        'api_calls': sum(fake.calls.values()),
+        'retry_afters': fake.retry_afters,
+        'reused_uploads': main.transfer.stats()['file_id_hits'],
+    }
+
+    dispatcher.job_queue.stop()
+    dispatcher.stop()
+    main.sender.shutdown()
+    main.engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def print_result(result):
+    print('\n== {scenario}: {submissions} submissions x {admins} admins x {tenants} channels'.format(**result))
+    print('   delivered        {delivered}'.format(**result))
+    print('   throughput       {subs_per_sec:.1f} submissions/s (ingest {ingest_sec:.2f}s)'.format(**result))
+    print('   to admin         p50 {p50_ms:.0f} ms, p99 {p99_ms:.0f} ms'.format(**result))
+    print('   database         {db_ms:.0f} ms in {db_queries} queries'.format(**result))
+    print('   temp/            {temp_written_mb:.1f} MB written, {temp_size_mb:.1f} MB left'.format(**result))
+    print('   uploads          {uploaded_mb:.1f} MB in {api_calls} API calls, '
+          '{retry_afters} RetryAfter, {reused_uploads} sent by file_id'.format(**result))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark for predlozhka handlers')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run: {} (default: all)'.format(
+        ', '.join(SCENARIOS)))
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per Bot API call')
+    parser.add_argument('--upload-mbps', type=float, default=10, help='upload bandwidth, MB/s')
+    parser.add_argument('--download-mbps', type=float, default=50, help='download bandwidth, MB/s')
+    parser.add_argument('--retry-after-rate', type=float, default=0.0,
+                        help='probability of RetryAfter on admin sends')
+    parser.add_argument('--file-size-kb', type=int, default=200, help='media size unless the scenario sets one')
+    parser.add_argument('--download', action='store_true', help='download media to temp/ instead of file_id')
+    parser.add_argument('--real-limits', action='store_true', help='keep Telegram flood limits in the sender')
+    parser.add_argument('--timeout', type=float, default=300, help='max seconds to wait for deliveries')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error('unknown scenarios: {}'.format(', '.join(unknown)))
+    return args
+
+
+def bench(argv=None):
+    args = parse_args(argv)
+    for name in args.scenarios or list(SCENARIOS):
+        print_result(run_scenario(name, SCENARIOS[name], args))
+
+
+if __name__ == '__main__':
+    bench(sys.argv[1:])
@@ -0,0 +1,136 @@
+import threading
+import time
+
+from sqlalchemy import or_
+
+from sqlhelper import User, Tenant, TenantMember
+
+# сколько привязок «пользователь -> канал» держать в памяти
+MAX_ROUTES = 100000
+
+
+class TenantCache:
+    # Каналы, их админы и забаненные меняются редко, а читаются на каждый апдейт,
+    # поэтому держим их в памяти и сбрасываем после каждой записи.
+    # Канал, в который пишет пользователь, читаем из users.tenant_id один раз и дальше помним.
+    # Если процессов несколько, чужие записи сюда не доходят — тогда ttl ограничивает возраст кэша
+    def __init__(self, session_factory, ttl=None):
+        self._session_factory = session_factory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._state = None
+        self._loaded_at = 0
+        self._routes = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _load(self):
+        db = self._session_factory()
+        try:
+            tenants = db.query(Tenant).order_by(Tenant.tenant_id).all()
+            for tenant in tenants:
+                db.expunge(tenant)
+            members = db.query(TenantMember.tenant_id, TenantMember.user_id, TenantMember.is_admin,
+                               TenantMember.banned) \
+                .filter(or_(TenantMember.is_admin, TenantMember.banned)).all()
+        finally:
+            db.close()
+
+        admin_ids = {t.tenant_id: set() for t in tenants}
+        banned_ids = {t.tenant_id: set() for t in tenants}
+        admin_tenants = {}
+        for m in members:
+            if m.tenant_id not in admin_ids:
+                continue
+            if m.is_admin:
+                admin_ids[m.tenant_id].add(m.user_id)
+                admin_tenants.setdefault(m.user_id, []).append(m.tenant_id)
+            if m.banned:
+                banned_ids[m.tenant_id].add(m.user_id)
+
+        return {
+            'tenants': {t.tenant_id: t for t in tenants},
+            'slugs': {t.slug: t for t in tenants},
+            'default': tenants[0].tenant_id if tenants else None,
+            'admin_ids': {k: frozenset(v) for k, v in admin_ids.items()},
+            'banned_ids': {k: frozenset(v) for k, v in banned_ids.items()},
+            'admin_tenants': {k: tuple(sorted(v)) for k, v in admin_tenants.items()},
+        }
+
+    def _ensure(self):
+        with self._lock:
+            if self._state is not None and self.ttl and time.monotonic() - self._loaded_at > self.ttl:
+                self._state = None
+                self._routes.clear()
+            if self._state is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._state = self._load()
+                self._loaded_at = time.monotonic()
+            return self._state
+
+    def tenant(self, tenant_id):
+        return self._ensure()['tenants'].get(tenant_id)
+
+    def tenants(self):
+        return list(self._ensure()['tenants'].values())
+
+    def by_slug(self, slug):
+        return self._ensure()['slugs'].get(slug)
+
+    def default_id(self):
+        return self._ensure()['default']
+
+    def admin_ids(self, tenant_id):
+        return self._ensure()['admin_ids'].get(tenant_id, frozenset())
+
+    def banned_ids(self, tenant_id):
+        return self._ensure()['banned_ids'].get(tenant_id, frozenset())
+
+    def admin_tenants(self, user_id):
+        # каналы, где пользователь админ, по возрастанию tenant_id
+        return self._ensure()['admin_tenants'].get(user_id, ())
+
+    def tenant_of(self, user_id):
+        # канал, в который пишет пользователь: выбранный по ссылке или канал по умолчанию
+        with self._lock:
+            found = user_id in self._routes
+            tenant_id = self._routes.get(user_id)
+        if not found:
+            db = self._session_factory()
+            try:
+                tenant_id = db.query(User.tenant_id).filter_by(user_id=user_id).scalar()
+            finally:
+                db.close()
+            self.route(user_id, tenant_id)
+
+        state = self._ensure()
+        return tenant_id if tenant_id in state['tenants'] else state['default']
+
+    def route(self, user_id, tenant_id):
+        with self._lock:
+            if user_id not in self._routes and len(self._routes) >= MAX_ROUTES:
+                self._routes.clear()
+            self._routes[user_id] = tenant_id
+
+    def is_banned(self, user_id):
+        return user_id in self.banned_ids(self.tenant_of(user_id))
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'tenants': len(self._state['tenants']) if self._state else 0,
+                'routes': len(self._routes),
+            }
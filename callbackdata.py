@@ -0,0 +1,63 @@
+import json
+
+# Формат v1: '1' + код действия (один символ) + номер поста в base62.
+# Например, принять пост 123456 — '1aw7e', 5 байт вместо ~35 у JSON.
+# Если чисел несколько (страница очереди — канал и курсор), они идут через точку: '1p2.w7e'
+VERSION = '1'
+ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+SEPARATOR = '.'
+
+# новые действия добавляются сюда; коды уже выданных кнопок менять нельзя
+ACTION_CODES = {
+    'accept': 'a',
+    'decline': 'd',
+    'ban': 'b',
+    'status': 's',
+    'show': 'v',
+    'page': 'p',
+}
+_ACTIONS = {code: action for action, code in ACTION_CODES.items()}
+
+
+def _to_base62(number):
+    if number == 0:
+        return ALPHABET[0]
+    digits = []
+    while number:
+        number, rem = divmod(number, 62)
+        digits.append(ALPHABET[rem])
+    return ''.join(reversed(digits))
+
+
+def _from_base62(text):
+    number = 0
+    for c in text:
+        number = number * 62 + _INDEX[c]
+    return number
+
+
+def encode(action, *numbers):
+    return VERSION + ACTION_CODES[action] + SEPARATOR.join(_to_base62(n) for n in numbers)
+
+
+def decode(data):
+    # (action, post_id) или (action, (число, число, ...)), если чисел в кнопке несколько;
+    # ValueError, если разобрать не удалось
+    if not data:
+        raise ValueError('empty callback data')
+
+    # старые карточки с JSON-кнопками
+    if data[0] == '{':
+        payload = json.loads(data)
+        if not isinstance(payload, dict):
+            raise ValueError('bad callback data: {!r}'.format(data))
+        return payload.get('action'), payload.get('post')
+
+    if data[0] != VERSION or len(data) < 3:
+        raise ValueError('unknown callback data format: {!r}'.format(data))
+    try:
+        numbers = [_from_base62(part) for part in data[2:].split(SEPARATOR)]
+        return _ACTIONS[data[1]], numbers[0] if len(numbers) == 1 else tuple(numbers)
+    except KeyError:
+        raise ValueError('bad callback data: {!r}'.format(data))
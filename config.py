@@ -0,0 +1,85 @@
+import os
+import argparse
+
+# Настройки бота — переменные PREDLOZHKA_*. Их можно задать в файле, в окружении и флагами командной
+# строки: окружение важнее файла, флаги важнее окружения. main.py читает итог из os.environ
+PREFIX = 'PREDLOZHKA_'
+
+# флаги для самых частых настроек, остальные задаются через --set KEY=VALUE
+FLAGS = (
+    ('--token', 'TOKEN', 'токен бота (надёжнее передать через окружение или --token-file)'),
+    ('--token-file', 'TOKEN_FILE', 'файл с токеном бота, например Docker secret'),
+    ('--db-url', 'DB_URL', 'адрес базы в формате SQLAlchemy'),
+    ('--role', 'ROLE', 'all, ingress или worker'),
+    ('--mode', 'MODE', 'polling или webhook'),
+    ('--metrics-port', 'METRICS_PORT', 'порт /metrics, /healthz и /readyz (0 — выключить)'),
+)
+
+
+def env_name(key):
+    key = key.strip().upper().replace('-', '_')
+    return key if key.startswith(PREFIX) else PREFIX + key
+
+
+def _pair(text):
+    key, sep, value = text.partition('=')
+    if not sep or not key.strip():
+        raise argparse.ArgumentTypeError('ожидается KEY=VALUE, получено {!r}'.format(text))
+    return env_name(key), value
+
+
+def read_file(path):
+    # строки KEY=VALUE как в .env; пустые и начинающиеся с # пропускаются, префикс PREDLOZHKA_ можно опустить
+    values = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    key, value = _pair(line)
+                except argparse.ArgumentTypeError as e:
+                    raise SystemExit('Файл настроек {}, строка {}: {}'.format(path, lineno, e))
+                values[key] = value.strip().strip('"\'')
+    except OSError as e:
+        raise SystemExit('Не удалось прочитать файл настроек {}: {}'.format(path, e))
+    return values
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='main.py', description='Бот-предложка для каналов Telegram.')
+    parser.add_argument('--config', help='файл с настройками KEY=VALUE (или PREDLOZHKA_CONFIG)')
+    for flag, key, help in FLAGS:
+        parser.add_argument(flag, dest=key, help=help)
+    parser.add_argument('--set', dest='overrides', type=_pair, action='append', default=[], metavar='KEY=VALUE',
+                        help='любая другая настройка, например --set DIGEST_MODE=1')
+    return parser.parse_args(argv)
+
+
+def load(argv=None, environ=os.environ):
+    # переносит настройки из файла и флагов в environ
+    args = parse_args(argv)
+    path = args.config or environ.get(PREFIX + 'CONFIG')
+    if path:
+        for key, value in read_file(path).items():
+            environ.setdefault(key, value)
+
+    for _, key, _ in FLAGS:
+        if getattr(args, key) is not None:
+            environ[PREFIX + key] = getattr(args, key)
+    environ.update(args.overrides)
+    return environ
+
+
+def read_token(environ=os.environ):
+    # PREDLOZHKA_TOKEN или первая строка файла PREDLOZHKA_TOKEN_FILE; None, если токен не задан
+    token = environ.get(PREFIX + 'TOKEN')
+    path = environ.get(PREFIX + 'TOKEN_FILE')
+    if not token and path:
+        try:
+            with open(path, encoding='utf-8') as f:
+                token = f.readline()
+        except OSError as e:
+            raise SystemExit('Не удалось прочитать токен из {}: {}'.format(path, e))
+    return token.strip() if token else None
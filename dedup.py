@@ -0,0 +1,126 @@
+import io
+import threading
+import time
+from collections import deque
+
+try:
+    from PIL import Image
+except ImportError:
+    # без Pillow остаются только точные совпадения
+    Image = None
+
+# Расстояние Хэмминга между 64-битными dHash, при котором картинки считаем похожими
+MAX_DISTANCE = 6
+# сколько секунд помнить хэши
+WINDOW = 72 * 3600
+HASH_SIZE = 8
+
+_UINT64 = 1 << 64
+
+
+def perceptual_hash(data, size=HASH_SIZE):
+    # dHash: уменьшаем до (size+1)×size в оттенках серого и сравниваем соседние пиксели по строкам.
+    # Пережимание, ресайз и мелкие правки меняют лишь несколько бит из 64
+    if Image is None or not data:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG можно декодировать сразу в уменьшенном виде — в разы быстрее полного разбора
+            img.draft('L', (size * 8, size * 8))
+            pixels = list(img.convert('L').resize((size + 1, size), Image.BILINEAR).getdata())
+    except (OSError, ValueError):
+        return None
+
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def to_signed(phash):
+    # SQLite хранит INTEGER как знаковое 64-битное число
+    if phash is None:
+        return None
+    return phash - _UINT64 if phash >= _UINT64 >> 1 else phash
+
+
+def to_unsigned(value):
+    if value is None:
+        return None
+    return value % _UINT64
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class DuplicateIndex:
+    # Хэши медиа недавних постов в памяти. Точные ключи — file_unique_id от Telegram и sha256 файла,
+    # похожие картинки ищем перебором dHash: на окно в несколько тысяч постов это доли миллисекунды.
+    # У каждого канала свои повторы: одну и ту же картинку можно предложить в два разных канала
+    def __init__(self, max_distance=MAX_DISTANCE, window=WINDOW):
+        self.max_distance = max_distance
+        self.window = window
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._phashes = deque()
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+
+    def add(self, post_id, file_unique_id=None, sha256=None, phash=None, added_at=None, tenant_id=None):
+        added_at = added_at if added_at is not None else time.time()
+        with self._lock:
+            self._prune()
+            for key in (file_unique_id, sha256):
+                if key:
+                    self._exact[(tenant_id, key)] = (post_id, added_at)
+            if phash is not None:
+                self._phashes.append((added_at, post_id, phash, tenant_id))
+
+    def _prune(self):
+        cutoff = time.time() - self.window
+        while self._phashes and self._phashes[0][0] < cutoff:
+            self._phashes.popleft()
+        if len(self._exact) > 2 * len(self._phashes) + 1000:
+            self._exact = {k: v for k, v in self._exact.items() if v[1] >= cutoff}
+
+    def find(self, file_unique_id=None, sha256=None, phash=None, tenant_id=None):
+        # кандидаты [(post_id, расстояние, точное ли совпадение)], лучшие первыми;
+        # живой ли ещё пост, проверяет вызывающий
+        cutoff = time.time() - self.window
+        found = {}
+        with self._lock:
+            self.lookups += 1
+            for key in (file_unique_id, sha256):
+                hit = self._exact.get((tenant_id, key)) if key else None
+                if hit and hit[1] >= cutoff:
+                    found[hit[0]] = (hit[0], 0, True)
+            if phash is not None and self.max_distance > 0:
+                for added_at, post_id, other, other_tenant in self._phashes:
+                    if post_id in found or added_at < cutoff or other_tenant != tenant_id:
+                        continue
+                    d = distance(phash, other)
+                    if d <= self.max_distance:
+                        found[post_id] = (post_id, d, False)
+        return sorted(found.values(), key=lambda c: (not c[2], c[1], -c[0]))
+
+    def count_hit(self, exact):
+        with self._lock:
+            if exact:
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'exact_keys': len(self._exact),
+                'phashes': len(self._phashes),
+                'lookups': self.lookups,
+                'exact_hits': self.exact_hits,
+                'near_hits': self.near_hits,
+                'perceptual': Image is not None and self.max_distance > 0,
+            }
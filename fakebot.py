@@ -0,0 +1,166 @@
+import os
+import time
+import random
+import threading
+from types import SimpleNamespace
+from collections import Counter
+
+from telegram import InputFile
+from telegram.error import RetryAfter
+
+MB = 1024 * 1024
+
+
+class FakeMessage:
+    def __init__(self, message_id, chat_id, file_id=None):
+        self.message_id = message_id
+        self.chat_id = chat_id
+        # загруженный файл Telegram возвращает с новым file_id; тип здесь не важен
+        self.document = SimpleNamespace(file_id=file_id) if file_id else None
+
+
+class FakeFile:
+    def __init__(self, bot, file_id, file_size):
+        self.bot = bot
+        self.file_id = file_id
+        self.file_unique_id = file_id
+        self.file_size = file_size
+        self.file_path = '{}.bin'.format(file_id)
+
+    def _content(self):
+        # у каждого file_id своё содержимое, иначе хранилище в temp/ схлопнет все файлы в один
+        header = self.file_id.encode()
+        return header + bytes(max(self.file_size - len(header), 0))
+
+    def download(self, custom_path=None, out=None, timeout=None):
+        data = self._content()
+        time.sleep(len(data) / self.bot.download_bandwidth)
+        self.bot.count_download(len(data))
+        if out is not None:
+            out.write(data)
+            return out
+        path = custom_path or self.file_path
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+def _payload_size(media):
+    # сколько байт ушло бы в Telegram: file_id — ноль, файл — его размер
+    if isinstance(media, (list, tuple)):
+        return sum(_payload_size(m) for m in media)
+    media = getattr(media, 'media', media)
+    if isinstance(media, InputFile):
+        return len(media.input_file_content)
+    if hasattr(media, 'read'):
+        return len(media.read())
+    return 0
+
+
+class FakeBot:
+    # Заменяет telegram.Bot без сети. Каждый вызов ждёт latency секунд плюс время загрузки
+    # при заданной пропускной способности. Вызовы для flaky_chats с вероятностью retry_after_rate
+    # падают с RetryAfter
+    defaults = None
+    id = 1
+    username = 'predlozhka_bench_bot'
+    first_name = 'Bench'
+
+    def __init__(self, latency=0.05, upload_bandwidth=10 * MB, download_bandwidth=50 * MB,
+                 retry_after_rate=0.0, retry_after=1, file_size=200 * 1024, flaky_chats=None):
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth
+        self.download_bandwidth = download_bandwidth
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.file_size = file_size
+        self.flaky_chats = flaky_chats
+
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.calls = Counter()
+        self.retry_afters = 0
+        self.uploaded_bytes = 0
+        self.downloaded_bytes = 0
+        # (monotonic, chat_id, текст или подпись) для каждого доставленного сообщения
+        self.deliveries = []
+
+    def count_download(self, size):
+        with self._lock:
+            self.downloaded_bytes += size
+
+    def _call(self, method, chat_id=None, media=None, text=None):
+        with self._lock:
+            self.calls[method] += 1
+        flaky = self.flaky_chats is None or chat_id in self.flaky_chats
+        if flaky and self.retry_after_rate and random.random() < self.retry_after_rate:
+            with self._lock:
+                self.retry_afters += 1
+            raise RetryAfter(self.retry_after)
+
+        size = _payload_size(media)
+        time.sleep(self.latency + size / self.upload_bandwidth)
+
+        with self._lock:
+            self.uploaded_bytes += size
+            self._message_id += 1
+            if chat_id is not None:
+                self.deliveries.append((time.monotonic(), chat_id, text))
+            file_id = 'uploaded-{}'.format(self._message_id) if size else None
+            return FakeMessage(self._message_id, chat_id, file_id)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._call('sendMessage', chat_id, text=text)
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        return self._call('sendPhoto', chat_id, photo, caption)
+
+    def send_video(self, chat_id, video, caption=None, **kwargs):
+        return self._call('sendVideo', chat_id, video, caption)
+
+    def send_audio(self, chat_id, audio, caption=None, **kwargs):
+        return self._call('sendAudio', chat_id, audio, caption)
+
+    def send_voice(self, chat_id, voice, caption=None, **kwargs):
+        return self._call('sendVoice', chat_id, voice, caption)
+
+    def send_document(self, chat_id, document, caption=None, **kwargs):
+        return self._call('sendDocument', chat_id, document, caption)
+
+    def send_sticker(self, chat_id, sticker, **kwargs):
+        return self._call('sendSticker', chat_id, sticker)
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        message = self._call('sendMediaGroup', chat_id, media, getattr(media[0], 'caption', None))
+        return [FakeMessage(message.message_id, chat_id, 'uploaded-{}-{}'.format(message.message_id, i)
+                            if _payload_size(m) else None) for i, m in enumerate(media)]
+
+    def edit_message_reply_markup(self, chat_id=None, message_id=None, **kwargs):
+        return self._call('editMessageReplyMarkup')
+
+    def answer_callback_query(self, *args, **kwargs):
+        return self._call('answerCallbackQuery')
+
+    def ban_chat_member(self, chat_id, user_id, **kwargs):
+        return self._call('banChatMember')
+
+    def get_file(self, file_id, **kwargs):
+        self._call('getFile')
+        return FakeFile(self, file_id, self.file_size)
+
+    def set_webhook(self, *args, **kwargs):
+        return True
+
+    def delete_webhook(self, *args, **kwargs):
+        return True
+
+
+def dir_size(path):
+    total = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return total
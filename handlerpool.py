@@ -0,0 +1,86 @@
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('predlozhka.handlers')
+
+
+class HandlerPool:
+    # Пул потоков обработчиков вместо run_async диспетчера. Апдейты одного пользователя (ключа)
+    # выполняются строго по очереди, разных — параллельно. submit() ждёт, пока в работе и в очереди
+    # за своим пользователем больше max_pending апдейтов: поток, который их подаёт (насос вебхука,
+    # диспетчер), встаёт, очередь вебхука заполняется, и Telegram получает 503
+    def __init__(self, workers=32, max_pending=None):
+        self.workers = workers
+        self.max_pending = max_pending or workers * 2
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        self._slots = threading.Semaphore(self.max_pending)
+        self._lock = threading.Lock()
+        # ключ -> апдейты, ждущие своей очереди; ключ есть, пока его цепочка выполняется
+        self._chains = {}
+
+        self._pending = 0
+        self._done = 0
+        self._failed = 0
+        self._waits = 0
+
+    def submit(self, key, fn, *args, **kwargs):
+        # key=None — порядок не важен, задача идёт сразу в пул
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            self._slots.acquire()
+
+        task = (contextvars.copy_context(), fn, args, kwargs)
+        with self._lock:
+            self._pending += 1
+            if key is not None:
+                chain = self._chains.get(key)
+                if chain is not None:
+                    chain.append(task)
+                    return
+                self._chains[key] = deque()
+        self._executor.submit(self._drain, key, task)
+
+    def _drain(self, key, task):
+        # выполняем задачи ключа одну за другой, пока его цепочка не опустеет
+        while task is not None:
+            ctx, fn, args, kwargs = task
+            try:
+                ctx.run(fn, *args, **kwargs)
+            except Exception:
+                # unit_of_work уже посчитал ошибку и откатил транзакцию
+                logger.exception('Handler %s failed', getattr(fn, '__name__', fn))
+                with self._lock:
+                    self._failed += 1
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self._done += 1
+                self._slots.release()
+
+            task = None
+            if key is not None:
+                with self._lock:
+                    chain = self._chains[key]
+                    if chain:
+                        task = chain.popleft()
+                    else:
+                        del self._chains[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'users': len(self._chains),
+                'done': self._done,
+                'failed': self._failed,
+                'waits': self._waits,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from sender import TokenBucket
+
+# сколько пользователей держать в памяти, прежде чем выкидывать простаивающие вёдра
+MAX_BUCKETS = 10000
+# предупреждаем о лимите не чаще раза в столько секунд на пользователя
+WARN_INTERVAL = 60
+
+OK = 'ok'
+BANNED = 'banned'
+LIMITED = 'limited'
+
+
+class IngressGuard:
+    # Проверка на входе, до get_file(): бан и личный лимит сообщений.
+    # Отсеянные апдейты стоят один поиск в set и одно ведро.
+    # is_banned(user_id) — забанен ли пользователь в предложке, куда он пишет
+    def __init__(self, rate_per_minute, burst, is_banned):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self._is_banned = is_banned
+        self._buckets = {}
+        self._warned = {}
+        self._lock = threading.Lock()
+        self.passed = 0
+        self.shed_banned = 0
+        self.shed_limited = 0
+
+    def _bucket(self, user_id):
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune()
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[user_id] = bucket
+            return bucket
+
+    def _prune(self):
+        # полное ведро ничем не отличается от нового — его можно забыть
+        for user_id, bucket in list(self._buckets.items()):
+            if bucket.try_acquire(0) == 0 and bucket.tokens >= bucket.capacity:
+                del self._buckets[user_id]
+                self._warned.pop(user_id, None)
+
+    def check(self, user_id, check_ban=True):
+        # check_ban=False — только лимит: бан действует в одной предложке, а апдейт, например, уходит в другую
+        if check_ban and self._is_banned(user_id):
+            with self._lock:
+                self.shed_banned += 1
+            return BANNED
+
+        if self._bucket(user_id).try_acquire() > 0:
+            with self._lock:
+                self.shed_limited += 1
+            return LIMITED
+
+        with self._lock:
+            self.passed += 1
+        return OK
+
+    def should_warn(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._warned.get(user_id, 0) < WARN_INTERVAL:
+                return False
+            self._warned[user_id] = now
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'passed': self.passed,
+                'shed_banned': self.shed_banned,
+                'shed_limited': self.shed_limited,
+                'tracked_users': len(self._buckets),
+            }
@@ -0,0 +1,156 @@
+import os
+import re
+import time
+import random
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+INCOMING = 'incoming'
+# результаты предобработки (preprocess.Preprocessor)
+PROCESSED = 'processed'
+# файл хранилища: <первые два символа sha256>/<sha256><расширение>
+STORED_RE = re.compile(r'^([0-9a-f]{2})/\1[0-9a-f]{62}(\.[^/]*)?$')
+# недокачанные файлы в incoming/ старше этого считаем мусором
+INCOMING_TTL = 3600
+# свежий файл мог ещё не попасть в posts — не трогаем его до следующего прохода
+GRACE_PERIOD = 600
+
+logger = logging.getLogger('predlozhka.mediastore')
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, used, quota):
+        super().__init__('temp/ holds {} bytes, quota is {}'.format(used, quota))
+        self.used = used
+        self.quota = quota
+
+
+class MediaStore:
+    # Файлы лежат под именем своего sha256, поэтому одинаковые вложения хранятся один раз.
+    # Ссылки на файл — это посты с таким attachment_path, их считает sweep().
+    # Квота не выселяет файлы живых постов: в режиме без file_id пост без файла уже не опубликовать.
+    # Пока живые файлы не влезают в квоту, check_quota() не даёт скачивать новые
+    def __init__(self, root='temp', quota_bytes=None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.removed = 0
+        self.freed_bytes = 0
+        self.refused = 0
+        os.makedirs(os.path.join(root, INCOMING), exist_ok=True)
+        # занятое место: пересчитывается каждым sweep(), между ними растёт с каждым put()
+        self._used = sum(st.st_size for _, st in self._files())
+
+    def incoming_path(self, original_name: str) -> str:
+        base = Path(original_name).name
+        uniq = f"{random.randint(1, 10**12)}_{base}"
+        return os.path.join(self.root, INCOMING, uniq)
+
+    @staticmethod
+    def file_hash(path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def put(self, src_path, data=None):
+        # data — содержимое файла, если оно уже в памяти: тогда хэш считаем без чтения с диска
+        digest = hashlib.sha256(data).hexdigest() if data is not None else self.file_hash(src_path)
+        ext = Path(src_path).suffix.lower()
+        directory = os.path.join(self.root, digest[:2])
+        dest = os.path.join(directory, digest + ext)
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            if os.path.exists(dest):
+                os.remove(src_path)
+                # освежаем mtime, чтобы квота не выселила файл, который только что снова прислали
+                os.utime(dest)
+                self.deduplicated += 1
+            else:
+                os.replace(src_path, dest)
+                self.stored += 1
+                self._used += os.path.getsize(dest)
+        return dest
+
+    def check_quota(self, size=0):
+        # QuotaExceeded, если файл размера size уже не влезет в квоту
+        with self._lock:
+            if self.quota_bytes is None or self._used + size <= self.quota_bytes:
+                return
+            self.refused += 1
+            raise QuotaExceeded(self._used, self.quota_bytes)
+
+    def _owned(self, path):
+        # чистим только то, что создало само хранилище: файлы temp/ из старых версий бота
+        # (temp/<число>_<имя>) принадлежат постам, у которых нет file_id, и без них пост не опубликовать
+        rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+        return rel.split('/', 1)[0] in (INCOMING, PROCESSED) or bool(STORED_RE.match(rel))
+
+    def _files(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.removed += 1
+        self.freed_bytes += size
+
+    def sweep(self, referenced):
+        # referenced — пути, на которые ещё ссылаются живые посты
+        referenced = {os.path.normpath(p) for p in referenced if p}
+        now = time.time()
+        incoming = os.path.join(self.root, INCOMING)
+        used = 0
+        removed_before = self.removed
+
+        with self._lock:
+            for path, st in self._files():
+                if not self._owned(path):
+                    used += st.st_size
+                elif os.path.dirname(path) == incoming and now - st.st_mtime > INCOMING_TTL:
+                    self._remove(path, st.st_size)
+                elif os.path.dirname(path) != incoming and os.path.normpath(path) not in referenced \
+                        and now - st.st_mtime > GRACE_PERIOD:
+                    self._remove(path, st.st_size)
+                else:
+                    used += st.st_size
+            self._used = used
+
+        if self.quota_bytes is not None and used > self.quota_bytes:
+            # всё, что осталось, нужно живым постам — удалять нечего, новые файлы не принимаем
+            logger.warning('temp/ holds %.1f MB of live files, over the %.1f MB quota: downloads are refused',
+                           used / 1024 / 1024, self.quota_bytes / 1024 / 1024)
+        return self.removed - removed_before
+
+    def stats(self):
+        with self._lock:
+            files = 0
+            size = 0
+            for _, st in self._files():
+                files += 1
+                size += st.st_size
+            return {
+                'files': files,
+                'bytes': size,
+                'stored': self.stored,
+                'deduplicated': self.deduplicated,
+                'removed': self.removed,
+                'freed_bytes': self.freed_bytes,
+                'refused': self.refused,
+            }
@@ -0,0 +1,149 @@
+import datetime
+import logging
+import threading
+import time
+
+from sqlalchemy import or_
+from telegram.error import RetryAfter
+
+from sqlhelper import Post, OutboxEntry, transition_post
+
+# повторы публикации: 10 с, 20 с, 40 с ... но не реже раза в час
+BACKOFF = 10
+MAX_BACKOFF = 3600
+MAX_ATTEMPTS = 8
+BATCH = 10
+
+logger = logging.getLogger('predlozhka.outbox')
+
+
+class PublishOutbox:
+    # Принятые посты лежат в таблице outbox и публикуются фоновой задачей drain().
+    # Ошибка публикации откладывает пост с экспоненциальной задержкой, RetryAfter — на указанное время.
+    # interval > 0 — не чаще одного поста в interval секунд, чтобы пачка одобрений шла ровным потоком.
+    # Интервал и пауза после RetryAfter у каждого канала свои: лимит одного канала не держит остальные
+    def __init__(self, publish, on_published=None, on_gave_up=None, interval=0, max_attempts=MAX_ATTEMPTS,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        self._publish = publish
+        self._on_published = on_published
+        self._on_gave_up = on_gave_up
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._last_published = {}
+        self._paused_until = {}
+        self.published = 0
+        self.retried = 0
+        self.flood_waits = 0
+        self.gave_up = 0
+
+    def enqueue(self, db, post_id):
+        # коммитит вызывающий — вместе с переводом поста в publishing
+        db.add(OutboxEntry(post_id))
+
+    def _slot_free(self, tenant_id, now):
+        with self._lock:
+            if now < self._paused_until.get(tenant_id, 0.0):
+                return False
+            last = self._last_published.get(tenant_id)
+        return not self.interval or last is None or now - last >= self.interval
+
+    def _blocked(self, now):
+        with self._lock:
+            tenants = set(self._paused_until) | set(self._last_published)
+        return {t for t in tenants if not self._slot_free(t, now)}
+
+    def drain(self, db):
+        # сколько постов опубликовано за этот проход
+        before = self.published
+        while True:
+            # каналы, которые ждут интервала или RetryAfter, пропускаем прямо в запросе,
+            # иначе их очередь загородила бы посты остальных каналов
+            blocked = self._blocked(time.monotonic())
+            query = db.query(OutboxEntry, Post) \
+                .outerjoin(Post, Post.post_id == OutboxEntry.post_id) \
+                .filter(OutboxEntry.next_attempt_at <= datetime.datetime.utcnow())
+            if blocked:
+                query = query.filter(or_(Post.tenant_id.is_(None), Post.tenant_id.notin_(blocked)))
+            entries = query.order_by(OutboxEntry.next_attempt_at, OutboxEntry.id).limit(BATCH).all()
+            if not entries:
+                break
+            # каждая строка либо уходит из outbox, либо откладывается, либо её канал встаёт на паузу
+            processed = 0
+            for entry, post in entries:
+                if post is None or self._slot_free(post.tenant_id, time.monotonic()):
+                    self._drain_one(db, entry, post)
+                    processed += 1
+            if not processed:
+                break
+        return self.published - before
+
+    def _drain_one(self, db, entry, post):
+        if not post or post.status != 'publishing':
+            db.delete(entry)
+            db.commit()
+            return
+
+        try:
+            self._publish(db, post)
+        except RetryAfter as e:
+            # канал упёрся в лимит — ждёт весь этот канал, попытку не засчитываем
+            with self._lock:
+                self.flood_waits += 1
+                self._paused_until[post.tenant_id] = time.monotonic() + e.retry_after
+            entry.next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=e.retry_after)
+            db.commit()
+            return
+        except Exception as e:
+            self._failed(db, entry, post, e)
+            return
+
+        transition_post(db, post.post_id, 'publishing', 'published', commit=False)
+        db.delete(entry)
+        db.commit()
+        with self._lock:
+            self.published += 1
+            self._last_published[post.tenant_id] = time.monotonic()
+        if self._on_published:
+            self._on_published(db, post)
+
+    def _failed(self, db, entry, post, error):
+        entry.attempts += 1
+        entry.last_error = str(error)[:500]
+        if entry.attempts >= self.max_attempts:
+            # сдаёмся: пост возвращается на модерацию, а не пропадает
+            logger.error('Publishing post %s failed %s times, returning it to moderation: %s',
+                         post.post_id, entry.attempts, error)
+            transition_post(db, post.post_id, 'publishing', 'pending', commit=False)
+            db.delete(entry)
+            db.commit()
+            with self._lock:
+                self.gave_up += 1
+            if self._on_gave_up:
+                self._on_gave_up(db, post, error)
+            return
+
+        delay = min(self.backoff * 2 ** (entry.attempts - 1), self.max_backoff)
+        entry.next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+        db.commit()
+        with self._lock:
+            self.retried += 1
+        logger.warning('Publishing post %s failed (attempt %s), retry in %ss: %s',
+                       post.post_id, entry.attempts, delay, error)
+
+    def stats(self, db):
+        queued = db.query(OutboxEntry).count()
+        failing = db.query(OutboxEntry).filter(OutboxEntry.attempts > 0).count()
+        with self._lock:
+            return {
+                'queued': queued,
+                'failing': failing,
+                'published': self.published,
+                'retried': self.retried,
+                'flood_waits': self.flood_waits,
+                'gave_up': self.gave_up,
+                'interval': self.interval,
+            }
@@ -0,0 +1,228 @@
+import os
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+except ImportError:
+    # без Pillow тип файла всё равно определяется, но картинки не пережимаются
+    Image = None
+
+from mediastore import PROCESSED
+
+# Лимиты sendPhoto: до 10 МБ, сумма сторон до 10000. Длиннее MAX_SIDE Telegram всё равно ужмёт сам
+MAX_SIDE = 2560
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+JPEG_QUALITY = 85
+THUMB_SIDE = 320
+TIMEOUT = 60
+# голова файла для определения типа: в неё помещаются два кадра MP3 (кадр не длиннее 1441 байта)
+HEAD_SIZE = 4096
+ORIENTATION_TAG = 0x0112
+# MPEG audio Layer III: битрейты (кбит/с) и частоты по версии — 1 или 2/2.5
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {0b11: (44100, 48000, 32000), 0b10: (22050, 24000, 16000), 0b00: (11025, 12000, 8000)}
+
+logger = logging.getLogger('predlozhka.preprocess')
+
+
+def _mp3_frame_length(head, offset=0):
+    # длина кадра MP3 по его заголовку; None — это не заголовок кадра Layer III.
+    # Проверяем все поля: два байта синхрослова сами по себе встречаются где угодно,
+    # например FF FE — это BOM текста в UTF-16
+    if len(head) < offset + 4 or head[offset] != 0xFF or head[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version = head[offset + 1] >> 3 & 0b11
+    layer = head[offset + 1] >> 1 & 0b11
+    bitrate_index = head[offset + 2] >> 4
+    rate_index = head[offset + 2] >> 2 & 0b11
+    if version == 0b01 or layer != 0b01 or bitrate_index in (0, 0xF) or rate_index == 0b11 \
+            or head[offset + 3] & 0b11 == 0b10:
+        return None
+    bitrate = MP3_BITRATES[1 if version == 0b11 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = head[offset + 2] >> 1 & 1
+    return (144 if version == 0b11 else 72) * bitrate // sample_rate + padding
+
+
+def _is_mp3(head):
+    if head.startswith(b'ID3'):
+        return True
+    length = _mp3_frame_length(head)
+    if length is None:
+        return False
+    # если следующий кадр попал в голову файла, он должен начинаться ровно там, где кончился первый
+    return len(head) < length + 4 or _mp3_frame_length(head, length) is not None
+
+
+def sniff(head):
+    # тип по первым байтам файла, а не по расширению: (media_type, расширение)
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'photo', '.jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'photo', '.png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'photo', '.webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio', '.wav'
+    if head[4:8] == b'ftyp':
+        # m4a — тот же контейнер MP4, но со звуком
+        if head[8:12] in (b'M4A ', b'M4B '):
+            return 'audio', '.m4a'
+        return 'video', '.mp4'
+    if _is_mp3(head):
+        return 'audio', '.mp3'
+    if head.startswith(b'fLaC'):
+        return 'audio', '.flac'
+    if head.startswith(b'OggS'):
+        return 'voice', '.ogg'
+    return 'document', None
+
+
+def _watermark(img, text):
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.load_default(size=max(12, img.width // 40))
+    except TypeError:
+        # Pillow < 10.1: шрифт по умолчанию одного размера
+        font = ImageFont.load_default()
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    margin = max(8, img.width // 100)
+    position = (img.width - (right - left) - margin, img.height - (bottom - top) - margin)
+    draw.text(position, text, font=font, fill=(255, 255, 255), stroke_width=2, stroke_fill=(0, 0, 0))
+
+
+def process_image(src, dest_base, max_side=MAX_SIDE, watermark=None):
+    # Выполняется в отдельном процессе. Пишет dest_base + .jpg/.png и dest_base + .thumb.jpg
+    size = os.path.getsize(src)
+    with Image.open(src) as original:
+        source_format = original.format
+        icc_profile = original.info.get('icc_profile')
+        rotated = original.getexif().get(ORIENTATION_TAG, 1) != 1
+        resize = max(original.size) > max_side
+        oversized = size > MAX_PHOTO_BYTES
+        os.makedirs(os.path.dirname(dest_base), exist_ok=True)
+
+        if source_format == 'JPEG' and not (rotated or resize or oversized or watermark):
+            # только срезаем EXIF (в том числе геометку), не пережимая:
+            # quality='keep' сохраняет исходные таблицы квантования
+            img = original
+            path = dest_base + '.jpg'
+            img.save(path + '.tmp', 'JPEG', quality='keep', icc_profile=icc_profile)
+        else:
+            # поворот из EXIF применяем к пикселям, сами метаданные дальше не пишутся
+            img = ImageOps.exif_transpose(original)
+            lossless = source_format == 'PNG' and not (resize or oversized or watermark)
+            if not lossless and img.mode != 'RGB':
+                # прозрачность JPEG не умеет — кладём на белый фон
+                rgba = img.convert('RGBA')
+                img = Image.new('RGB', rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel('A'))
+            if resize:
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+            if watermark:
+                _watermark(img, watermark)
+
+            if lossless:
+                path = dest_base + '.png'
+                img.save(path + '.tmp', 'PNG', optimize=True)
+            else:
+                path = dest_base + '.jpg'
+                img.save(path + '.tmp', 'JPEG', quality=JPEG_QUALITY, optimize=True, icc_profile=icc_profile)
+        os.replace(path + '.tmp', path)
+
+        thumb = img.convert('RGB')
+        thumb.thumbnail((THUMB_SIDE, THUMB_SIDE))
+        thumb_path = dest_base + '.thumb.jpg'
+        thumb.save(thumb_path + '.tmp', 'JPEG', quality=70)
+        os.replace(thumb_path + '.tmp', thumb_path)
+
+    return {'media_type': 'photo', 'path': path, 'thumb_path': thumb_path, 'changed': True,
+            'bytes_in': size, 'bytes_out': os.path.getsize(path)}
+
+
+class Preprocessor:
+    # Подготовка медиа перед модерацией: настоящий тип по содержимому, а для картинок — срезать EXIF,
+    # ужать слишком большие, наложить водяной знак и сделать превью. Картинки обрабатываются в пуле
+    # процессов, чтобы не держать GIL потоков бота. Результат лежит в root/processed под хэшем исходника
+    # и параметров обработки, поэтому повторно тот же файл не обрабатывается
+    def __init__(self, root='temp', workers=2, max_side=MAX_SIDE, watermark=None, timeout=TIMEOUT):
+        self._dir = os.path.join(root, PROCESSED)
+        self.max_side = max_side
+        self.watermark = watermark
+        self.timeout = timeout
+        self.workers = workers
+        # картинки меняются только с Pillow, без него скачивать их ради предобработки незачем
+        self.images = Image is not None
+        # spawn: форк процесса с живыми потоками может унести в дочерний чужие блокировки
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self._signature = hashlib.sha256(repr((max_side, JPEG_QUALITY, watermark)).encode()).hexdigest()[:8]
+
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.cache_hits = 0
+        self.failed = 0
+        self.retyped = 0
+        self.bytes_saved = 0
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _cached(self, base):
+        for ext in ('.jpg', '.png'):
+            if os.path.exists(base + ext):
+                thumb_path = base + '.thumb.jpg'
+                return {'media_type': 'photo', 'path': base + ext, 'changed': True,
+                        'thumb_path': thumb_path if os.path.exists(thumb_path) else None}
+        return None
+
+    def process(self, path, digest, media_type):
+        # digest — sha256 исходного файла; возвращает {'media_type', 'path', 'thumb_path', 'changed'}
+        with open(path, 'rb') as f:
+            detected, _ = sniff(f.read(HEAD_SIZE))
+        if media_type != 'document' and detected != media_type:
+            # фото, видео и прочее Telegram типизирует сам — перепроверяем только документы
+            return {'media_type': media_type, 'path': path, 'thumb_path': None, 'changed': False}
+        if detected != media_type:
+            self._count('retyped')
+        result = {'media_type': detected, 'path': path, 'thumb_path': None, 'changed': detected != media_type}
+        if detected != 'photo' or Image is None:
+            return result
+
+        base = os.path.join(self._dir, digest[:2], '{}-{}'.format(digest, self._signature))
+        cached = self._cached(base)
+        if cached:
+            self._count('cache_hits')
+            return cached
+
+        try:
+            done = self._executor.submit(process_image, path, base, self.max_side, self.watermark) \
+                .result(timeout=self.timeout)
+        except Exception:
+            self._count('failed')
+            raise
+        self._count('processed')
+        self._count('bytes_saved', done['bytes_in'] - done['bytes_out'])
+        return done
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'processed': self.processed,
+                'cache_hits': self.cache_hits,
+                'failed': self.failed,
+                'retyped': self.retyped,
+                'bytes_saved': self.bytes_saved,
+                'images': self.images,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,167 @@
+import threading
+import time
+import logging
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import RetryAfter, BadRequest, TimedOut, NetworkError
+
+# Лимиты Bot API: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+logger = logging.getLogger('predlozhka.sender')
+
+
+class SendFailed(Exception):
+    # шаг задачи (SendScheduler.call) не удался и после повторов; саму задачу повторять уже нельзя
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        # 0 — токен получен, иначе сколько секунд подождать
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        wait = self.try_acquire(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire(tokens)
+
+    def pause(self, seconds):
+        # уводим ведро в минус, чтобы следующий токен появился не раньше чем через seconds
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class SendScheduler:
+    def __init__(self, workers=8, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 max_retries=3, backoff=1.0):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sender')
+        self._global = TokenBucket(global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats = {}
+        self._chats_lock = threading.Lock()
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._flood_waits = 0
+        self._recent = deque()
+
+    def _chat_bucket(self, chat_id):
+        with self._chats_lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+                self._chats[chat_id] = bucket
+            return bucket
+
+    def submit(self, chat_id, fn, /, *args, **kwargs):
+        # chat_id и fn только позиционные: у самих методов Bot API тоже есть аргумент chat_id
+        with self._lock:
+            self._queued += 1
+        # задача выполняется в контексте отправителя — например, с его trace_id в логах
+        ctx = contextvars.copy_context()
+        return self._executor.submit(ctx.run, self._run, chat_id, fn, args, kwargs)
+
+    def call(self, chat_id, fn, /, *args, **kwargs):
+        # следующий шаг внутри задачи рассыльщика — с теми же лимитами и повторами, но в текущем потоке.
+        # Повторяется только этот шаг; если повторы кончились, задача падает с SendFailed и тоже не повторяется
+        try:
+            return self._attempt(chat_id, fn, args, kwargs)
+        except (RetryAfter, TimedOut, NetworkError) as e:
+            raise SendFailed(e) from e
+
+    def _run(self, chat_id, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+        try:
+            return self._attempt(chat_id, fn, args, kwargs)
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            logger.error('Send to %s failed: %s', chat_id, e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _attempt(self, chat_id, fn, args, kwargs):
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            # сначала ждём свой чат, чтобы не тратить общие токены впустую
+            chat_bucket.acquire()
+            self._global.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except RetryAfter as e:
+                with self._lock:
+                    self._flood_waits += 1
+                chat_bucket.pause(e.retry_after)
+                error = e
+            except BadRequest:
+                raise
+            except (TimedOut, NetworkError) as e:
+                time.sleep(self.backoff * 2 ** attempt)
+                error = e
+            else:
+                with self._lock:
+                    self._sent += 1
+                    self._recent.append(time.monotonic())
+                return result
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            with self._lock:
+                self._retried += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            return {
+                'workers': self.workers,
+                'queued': self._queued,
+                'in_flight': self._in_flight,
+                'sent': self._sent,
+                'failed': self._failed,
+                'retried': self._retried,
+                'flood_waits': self._flood_waits,
+                'per_second': len(self._recent) / 60,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -1,54 +1,556 @@
+import datetime
+
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, Boolean, String
+from sqlalchemy import Column, Integer, BigInteger, Boolean, String, Text, DateTime, Date, Index, \
+    ForeignKey, UniqueConstraint, create_engine, event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 
 Base = declarative_base()
 
+# id пользователей и чатов Telegram не влезают в 32 бита; в SQLite INTEGER и так 64-битный,
+# там оставляем его, чтобы схема старых баз не разъезжалась с моделью
+TelegramId = BigInteger().with_variant(Integer, 'sqlite')
+
 
 class User(Base):
     __tablename__ = 'users'
-    user_id = Column(Integer, unique=True, primary_key=True)
-    is_admin = Column(Boolean)
+    user_id = Column(TelegramId, unique=True, primary_key=True)
+    # is_admin и banned остались от бота на один канал: теперь роли лежат в tenant_members,
+    # а колонки нужны только старым миграциям
+    is_admin = Column(Boolean, index=True)
     state = Column(Integer)
+    banned = Column(Boolean, default=False, index=True)
+    # канал, в предложку которого пишет пользователь; NULL — канал по умолчанию
+    tenant_id = Column(Integer, ForeignKey('tenants.tenant_id'), index=True)
+
+    def __init__(self, user_id, is_admin=False, banned=False, tenant_id=None):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.banned = banned
+        self.tenant_id = tenant_id
+
+    def __repr__(self):
+        return '<User(user_id={}, tenant_id={})>'.format(self.user_id, self.tenant_id)
+
+
+class Tenant(Base):
+    # канал со своей предложкой; slug — параметр ссылки t.me/<бот>?start=<slug>
+    __tablename__ = 'tenants'
+    tenant_id = Column(Integer, primary_key=True)
+    slug = Column(String, unique=True)
+    target_channel = Column(String)
+    initializer_id = Column(TelegramId)
+    initialized = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # последний пост, попавший в дайджест этого канала
+    digest_cursor = Column(Integer, default=0)
+
+    def __init__(self, slug, target_channel=None, initializer_id=None, initialized=False, tenant_id=None):
+        self.tenant_id = tenant_id
+        self.slug = slug
+        self.target_channel = target_channel
+        self.initializer_id = initializer_id
+        self.initialized = initialized
+
+    def __repr__(self):
+        return '<Tenant(tenant_id={}, slug={}, target_channel={}, initializer_id={}, initialized={})>'.format(
+            self.tenant_id, self.slug, self.target_channel, self.initializer_id, self.initialized)
+
+
+class TenantMember(Base):
+    # роль пользователя в канале: админ предложки или забанен в ней
+    __tablename__ = 'tenant_members'
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, ForeignKey('tenants.tenant_id'))
+    user_id = Column(TelegramId, index=True)
+    is_admin = Column(Boolean, default=False)
+    banned = Column(Boolean, default=False)
+
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'user_id', name='uq_tenant_members_tenant_user'),
+    )
 
-    def __init__(self, user_id, is_admin=False):
+    def __init__(self, tenant_id, user_id, is_admin=False, banned=False):
+        self.tenant_id = tenant_id
         self.user_id = user_id
         self.is_admin = is_admin
+        self.banned = banned
 
     def __repr__(self):
-        return '<User(user_id={}, user_is_admin={})>'.format(self.user_id, self.is_admin)
+        return '<TenantMember(tenant_id={}, user_id={}, is_admin={}, banned={})>'.format(
+            self.tenant_id, self.user_id, self.is_admin, self.banned)
 
 
 class Post(Base):
     __tablename__ = 'posts'
     post_id = Column(Integer, unique=True, primary_key=True)
-    owner_id = Column(Integer)
+    owner_id = Column(TelegramId, index=True)
     attachment_path = Column(String)
     text = Column(String)
+    file_id = Column(String)
+    media_type = Column(String)
+    status = Column(String, default='pending')
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # превью после предобработки картинки
+    thumb_path = Column(String)
+    # пост, копией которого оказался этот; у точной копии статус 'duplicate', похожая идёт на модерацию с пометкой
+    duplicate_of = Column(Integer)
+    tenant_id = Column(Integer, ForeignKey('tenants.tenant_id'))
 
-    def __init__(self, owner_id, attachment_path, text):
+    __table_args__ = (
+        Index('ix_posts_status_created_at', 'status', 'created_at'),
+        # очередь модерации канала: WHERE tenant_id = ? AND status = 'pending' ORDER BY post_id
+        Index('ix_posts_tenant_status', 'tenant_id', 'status', 'post_id'),
+    )
+
+    def __init__(self, owner_id, attachment_path, text, file_id=None, media_type=None, duplicate_of=None,
+                 status='pending', thumb_path=None, tenant_id=None):
+        self.tenant_id = tenant_id
         self.owner_id = owner_id
         self.attachment_path = attachment_path
         self.text = text
+        self.file_id = file_id
+        self.media_type = media_type
+        self.thumb_path = thumb_path
+        self.duplicate_of = duplicate_of
+        self.status = status
 
     def __repr__(self):
-        return '<Post(post_id={}, owner_id={}, attachment_filename={}, text={}>'.format(self.post_id,
-                                                                                        self.owner_id,
-                                                                                        self.attachment_path,
-                                                                                        self.text)
+        return '<Post(post_id={}, tenant_id={}, owner_id={}, attachment_filename={}, file_id={}, media_type={}, status={}, ' \
+               'text={}>'.format(self.post_id,
+                                 self.tenant_id,
+                                 self.owner_id,
+                                 self.attachment_path,
+                                 self.file_id,
+                                 self.media_type,
+                                 self.status,
+                                 self.text)
 
 
-class Settings(Base):
-    __tablename__ = 'settings'
-    initialized = Column(Boolean, unique=True, primary_key=True)
-    target_channel = Column(String)
-    initializer_id = Column(Integer)
+class Attachment(Base):
+    # вложения альбома; у обычного поста файл лежит прямо в Post
+    __tablename__ = 'attachments'
+    attachment_id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey('posts.post_id'), index=True)
+    position = Column(Integer)
+    file_id = Column(String)
+    media_type = Column(String)
+    attachment_path = Column(String)
+    thumb_path = Column(String)
+
+    def __init__(self, post_id, position, file_id=None, media_type=None, attachment_path=None, thumb_path=None):
+        self.post_id = post_id
+        self.position = position
+        self.file_id = file_id
+        self.media_type = media_type
+        self.attachment_path = attachment_path
+        self.thumb_path = thumb_path
+
+    def __repr__(self):
+        return '<Attachment(post_id={}, position={}, file_id={}, media_type={}, attachment_path={})>'.format(
+            self.post_id, self.position, self.file_id, self.media_type, self.attachment_path)
+
+
+class ModerationMessage(Base):
+    # карточки поста у админов — чтобы после решения снять с них кнопки
+    __tablename__ = 'moderation_messages'
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey('posts.post_id'), index=True)
+    chat_id = Column(TelegramId)
+    message_id = Column(Integer)
+
+    def __init__(self, post_id, chat_id, message_id):
+        self.post_id = post_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    def __repr__(self):
+        return '<ModerationMessage(post_id={}, chat_id={}, message_id={})>'.format(self.post_id, self.chat_id,
+                                                                                  self.message_id)
+
+
+class MediaHash(Base):
+    # хэши медиа поста для поиска повторов: file_unique_id от Telegram, sha256 файла и dHash картинки
+    __tablename__ = 'media_hashes'
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey('posts.post_id'), index=True)
+    file_unique_id = Column(String, index=True)
+    sha256 = Column(String, index=True)
+    phash = Column(TelegramId)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __init__(self, post_id, file_unique_id=None, sha256=None, phash=None):
+        self.post_id = post_id
+        self.file_unique_id = file_unique_id
+        self.sha256 = sha256
+        self.phash = phash
+
+    def __repr__(self):
+        return '<MediaHash(post_id={}, file_unique_id={}, sha256={}, phash={})>'.format(
+            self.post_id, self.file_unique_id, self.sha256, self.phash)
+
+
+class OutboxEntry(Base):
+    # принятый пост, который ещё надо опубликовать в канал; строка живёт до успешной публикации
+    __tablename__ = 'outbox'
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey('posts.post_id'), unique=True)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __init__(self, post_id, next_attempt_at=None):
+        self.post_id = post_id
+        self.attempts = 0
+        self.next_attempt_at = next_attempt_at or datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return '<OutboxEntry(post_id={}, attempts={}, next_attempt_at={}, last_error={})>'.format(
+            self.post_id, self.attempts, self.next_attempt_at, self.last_error)
+
+
+class QueuedUpdate(Base):
+    # апдейт, принятый процессом ingress и ждущий воркера; key — пользователь или чат, по нему держится аренда
+    __tablename__ = 'update_queue'
+    id = Column(Integer, primary_key=True)
+    update_id = Column(TelegramId, unique=True)
+    key = Column(TelegramId, index=True)
+    payload = Column(Text)
+    lease_owner = Column(String)
+    lease_until = Column(DateTime)
+    attempts = Column(Integer, default=0)
+    done = Column(Boolean, default=False)
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_update_queue_done_lease', 'done', 'lease_until'),
+    )
+
+    def __init__(self, update_id, key, payload):
+        self.update_id = update_id
+        self.key = key
+        self.payload = payload
+        self.attempts = 0
+        self.done = False
+
+    def __repr__(self):
+        return '<QueuedUpdate(update_id={}, key={}, lease_owner={}, lease_until={}, attempts={}, done={})>'.format(
+            self.update_id, self.key, self.lease_owner, self.lease_until, self.attempts, self.done)
+
+
+class PostStat(Base):
+    # счётчики постов канала за день для /stats; день — когда пост предложили или решили его судьбу.
+    # Колонки названы по статусам, submitted — все предложенные
+    __tablename__ = 'post_stats'
+    tenant_id = Column(Integer, ForeignKey('tenants.tenant_id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    submitted = Column(Integer, default=0, nullable=False)
+    published = Column(Integer, default=0, nullable=False)
+    declined = Column(Integer, default=0, nullable=False)
+    duplicate = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return '<PostStat(tenant_id={}, day={}, submitted={}, published={}, declined={}, duplicate={})>'.format(
+            self.tenant_id, self.day, self.submitted, self.published, self.declined, self.duplicate)
+
+
+class ArchiveSegment(Base):
+    # кусок архива: JSON-строки решённых постов, сжатые zlib. Сам сегмент — файл path в каталоге архива,
+    # пишется один раз и больше не меняется; в базе только его описание
+    __tablename__ = 'archive_segments'
+    segment_id = Column(Integer, primary_key=True)
+    first_post_id = Column(Integer)
+    last_post_id = Column(Integer)
+    posts = Column(Integer)
+    raw_bytes = Column(Integer)
+    path = Column(String)
+    stored_bytes = Column(Integer)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __init__(self, first_post_id, last_post_id, posts, raw_bytes, path, stored_bytes):
+        self.first_post_id = first_post_id
+        self.last_post_id = last_post_id
+        self.posts = posts
+        self.raw_bytes = raw_bytes
+        self.path = path
+        self.stored_bytes = stored_bytes
+
+    def __repr__(self):
+        return '<ArchiveSegment(segment_id={}, posts={}-{}, raw_bytes={}, path={}, bytes={})>'.format(
+            self.segment_id, self.first_post_id, self.last_post_id, self.raw_bytes, self.path, self.stored_bytes)
 
-    def __init__(self, initialized, target_channel, initializer_id):
-        self.initialized = initialized
-        self.target_channel = target_channel
-        self.initializer_id = initializer_id
+
+class ArchivedPost(Base):
+    # оглавление архива: по нему посты ищутся по автору и дате без распаковки сегментов
+    __tablename__ = 'archived_posts'
+    post_id = Column(Integer, primary_key=True, autoincrement=False)
+    tenant_id = Column(Integer)
+    owner_id = Column(TelegramId)
+    status = Column(String)
+    created_at = Column(DateTime)
+    segment_id = Column(Integer, ForeignKey('archive_segments.segment_id'), index=True)
+
+    __table_args__ = (
+        Index('ix_archived_posts_owner', 'tenant_id', 'owner_id', 'created_at'),
+        Index('ix_archived_posts_created', 'tenant_id', 'created_at'),
+    )
+
+    def __init__(self, post_id, tenant_id, owner_id, status, created_at, segment_id):
+        self.post_id = post_id
+        self.tenant_id = tenant_id
+        self.owner_id = owner_id
+        self.status = status
+        self.created_at = created_at
+        self.segment_id = segment_id
 
     def __repr__(self):
-        return '<Settings(initialized={}, target_channel={}, initializer_id={})>'.format(self.initialized,
-                                                                                        self.target_channel,
-                                                                                        self.initializer_id)
+        return '<ArchivedPost(post_id={}, tenant_id={}, owner_id={}, status={}, segment_id={})>'.format(
+            self.post_id, self.tenant_id, self.owner_id, self.status, self.segment_id)
+
+
+class SchemaVersion(Base):
+    # номер последней применённой миграции; одна строка
+    __tablename__ = 'schema_version'
+    version = Column(Integer, primary_key=True)
+
+    def __init__(self, version):
+        self.version = version
+
+
+# канал, в который попадают пользователи без ссылки с slug и все данные бота до мультиканальности
+DEFAULT_TENANT_ID = 1
+DEFAULT_SLUG = 'main'
+
+
+# ============================
+#       СТАТУСЫ ПОСТОВ
+# ============================
+
+# pending -> publishing -> published, pending -> declined;
+# publishing -> pending, если публикация не удалась и пост надо вернуть в очередь
+POST_TRANSITIONS = {
+    ('pending', 'publishing'),
+    ('publishing', 'published'),
+    ('publishing', 'pending'),
+    ('pending', 'declined'),
+}
+
+
+def transition_post(db, post_id, from_status, to_status, commit=True):
+    # UPDATE ... WHERE status = from_status атомарен: из двух одновременных нажатий пройдёт только одно.
+    # commit=False — вызывающий коммитит сам, вместе со своими изменениями
+    if (from_status, to_status) not in POST_TRANSITIONS:
+        raise ValueError('Invalid post transition: {} -> {}'.format(from_status, to_status))
+    changed = db.query(Post) \
+        .filter_by(post_id=post_id, status=from_status) \
+        .update({'status': to_status}, synchronize_session=False)
+    if changed and to_status in ('published', 'declined'):
+        count_post(db, db.query(Post.tenant_id).filter_by(post_id=post_id).scalar(), to_status)
+    if commit:
+        db.commit()
+    return changed == 1
+
+
+def count_post(db, tenant_id, *columns, amount=1):
+    # +amount к счётчикам PostStat канала за сегодня в текущей транзакции. INSERT ... ON CONFLICT DO UPDATE
+    # не ломается, когда первый пост дня одновременно пишут два воркера
+    table = PostStat.__table__
+    dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table).values(tenant_id=tenant_id, day=datetime.datetime.utcnow().date(),
+                                        **{column: amount for column in columns})
+    db.execute(stmt.on_conflict_do_update(index_elements=['tenant_id', 'day'],
+                                          set_={column: table.c[column] + amount for column in columns}))
+
+# ============================
+#       ДВИЖОК И ПРАГМЫ
+# ============================
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', '5000'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', '-20000'),
+    ('foreign_keys', 'ON'),
+)
+
+
+def make_engine(url='sqlite:///database.db', pool_size=10):
+    if make_url(url).get_backend_name() != 'sqlite':
+        # PostgreSQL и другие серверные базы: соединение проверяем перед выдачей из пула,
+        # иначе после рестарта базы первый запрос каждого потока падал бы
+        return create_engine(url, pool_size=pool_size, max_overflow=pool_size, pool_pre_ping=True)
+
+    # WAL позволяет читать параллельно с записью, busy_timeout ждёт блокировку вместо 'database is locked'
+    engine = create_engine(url, poolclass=QueuePool, pool_size=pool_size, max_overflow=pool_size,
+                           connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+
+    return engine
+
+
+# ============================
+#          МИГРАЦИИ
+# ============================
+
+def _add_column(conn, table_name, column_name):
+    existing = {c['name'] for c in inspect(conn).get_columns(table_name)}
+    if column_name in existing:
+        return
+    column = Base.metadata.tables[table_name].c[column_name]
+    conn.exec_driver_sql('ALTER TABLE {} ADD COLUMN {} {}'.format(
+        table_name, column_name, column.type.compile(conn.dialect)))
+
+
+def _migration_1(conn):
+    # file_id, тип медиа и статус поста
+    for name in ('file_id', 'media_type', 'status', 'created_at'):
+        _add_column(conn, 'posts', name)
+    conn.exec_driver_sql("UPDATE posts SET status = 'pending' WHERE status IS NULL")
+    # срок хранения вложений старых постов отсчитываем от обновления, а не считаем его истёкшим
+    conn.exec_driver_sql('UPDATE posts SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL')
+
+
+def _migration_2(conn):
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_posts_owner_id ON posts (owner_id)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_posts_status_created_at ON posts (status, created_at)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_users_is_admin ON users (is_admin)')
+
+
+def _migration_3(conn):
+    # бан в предложке, а не только в канале
+    _add_column(conn, 'users', 'banned')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_users_banned ON users (banned)')
+
+
+def _migration_4(conn):
+    # альбомы: несколько вложений на один пост
+    Attachment.__table__.create(conn, checkfirst=True)
+
+
+def _migration_5(conn):
+    ModerationMessage.__table__.create(conn, checkfirst=True)
+
+
+def _migration_6(conn):
+    # очередь публикации; посты, застрявшие в publishing после падения, ставим в неё сразу
+    OutboxEntry.__table__.create(conn, checkfirst=True)
+    conn.exec_driver_sql(
+        "INSERT INTO outbox (post_id, attempts, next_attempt_at, created_at) "
+        "SELECT post_id, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM posts "
+        "WHERE status = 'publishing' AND post_id NOT IN (SELECT post_id FROM outbox)")
+
+
+def _migration_7(conn):
+    # поиск повторов
+    _add_column(conn, 'posts', 'duplicate_of')
+    MediaHash.__table__.create(conn, checkfirst=True)
+
+
+def _migration_8(conn):
+    # превью после предобработки
+    _add_column(conn, 'posts', 'thumb_path')
+    _add_column(conn, 'attachments', 'thumb_path')
+
+
+def _migration_9(conn):
+    # несколько каналов в одном процессе: строка settings становится каналом 1 (slug main),
+    # админы и забаненные — его участниками, все старые посты — его постами
+    Tenant.__table__.create(conn, checkfirst=True)
+    TenantMember.__table__.create(conn, checkfirst=True)
+    _add_column(conn, 'users', 'tenant_id')
+    _add_column(conn, 'posts', 'tenant_id')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_users_tenant_id ON users (tenant_id)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_posts_tenant_status ON posts (tenant_id, status, post_id)')
+
+    settings = None
+    if inspect(conn).has_table('settings'):
+        settings = conn.exec_driver_sql(
+            'SELECT initialized, target_channel, initializer_id FROM settings LIMIT 1').first()
+    conn.execute(Tenant.__table__.insert().values(
+        tenant_id=DEFAULT_TENANT_ID, slug=DEFAULT_SLUG, initialized=bool(settings and settings[0]),
+        target_channel=settings[1] if settings else None, initializer_id=settings[2] if settings else None,
+        created_at=datetime.datetime.utcnow()))
+    conn.exec_driver_sql(
+        'INSERT INTO tenant_members (tenant_id, user_id, is_admin, banned) '
+        'SELECT {}, user_id, COALESCE(is_admin, FALSE), COALESCE(banned, FALSE) FROM users '
+        'WHERE is_admin OR banned'.format(DEFAULT_TENANT_ID))
+    conn.exec_driver_sql('UPDATE posts SET tenant_id = {}'.format(DEFAULT_TENANT_ID))
+
+
+def _migration_10(conn):
+    # очередь апдейтов между ingress и воркерами, курсор дайджеста переехал из памяти процесса в базу
+    QueuedUpdate.__table__.create(conn, checkfirst=True)
+    _add_column(conn, 'tenants', 'digest_cursor')
+
+
+def _migration_11(conn):
+    # архив решённых постов и счётчики для /stats; счётчики заполняем по уже накопленным постам,
+    # решения до миграции относим ко дню, когда пост предложили
+    PostStat.__table__.create(conn, checkfirst=True)
+    ArchiveSegment.__table__.create(conn, checkfirst=True)
+    ArchivedPost.__table__.create(conn, checkfirst=True)
+    conn.exec_driver_sql(
+        'INSERT INTO post_stats (tenant_id, day, submitted, published, declined, duplicate) '
+        'SELECT tenant_id, DATE(COALESCE(created_at, CURRENT_TIMESTAMP)), COUNT(*), '
+        "SUM(CASE WHEN status = 'published' THEN 1 ELSE 0 END), "
+        "SUM(CASE WHEN status = 'declined' THEN 1 ELSE 0 END), "
+        "SUM(CASE WHEN status = 'duplicate' THEN 1 ELSE 0 END) "
+        'FROM posts WHERE tenant_id IS NOT NULL GROUP BY tenant_id, DATE(COALESCE(created_at, CURRENT_TIMESTAMP))')
+
+
+# номер миграции = её позиция в списке, текущая версия хранится в таблице schema_version
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+    _migration_9,
+    _migration_10,
+    _migration_11,
+]
+
+
+def _schema_version(conn):
+    if inspect(conn).has_table('schema_version'):
+        return conn.execute(SchemaVersion.__table__.select()).scalar() or 0
+    if conn.dialect.name == 'sqlite':
+        # базы до schema_version хранили версию в PRAGMA user_version
+        return conn.exec_driver_sql('PRAGMA user_version').scalar()
+    return 0
+
+
+def schema_version(engine):
+    with engine.connect() as conn:
+        return _schema_version(conn)
+
+
+def migrate(engine):
+    with engine.begin() as conn:
+        version = _schema_version(conn)
+
+        if not inspect(conn).has_table('posts'):
+            # новая база — схема сразу актуальная
+            Base.metadata.create_all(conn)
+        else:
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                print('[Predlozhka]Applying migration {}...'.format(number))
+                migration(conn)
+            Base.metadata.create_all(conn)
+
+        conn.execute(SchemaVersion.__table__.delete())
+        conn.execute(SchemaVersion.__table__.insert().values(version=len(MIGRATIONS)))
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+# модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(request, tmp_path, monkeypatch):
+    # бот целиком на FakeBot и своей SQLite: апдейты идут через диспетчер, как в проде.
+    # Роль процесса задаётся параметром: @pytest.mark.parametrize('app', ['worker'], indirect=True)
+    import main
+    from fakebot import FakeBot
+    from sender import SendScheduler
+    from sqlhelper import make_engine, migrate
+
+    role = getattr(request, 'param', 'all')
+    monkeypatch.setattr(main, 'ROLE', role)
+    db_url = 'sqlite:///{}'.format(tmp_path / 'test.db')
+    if role == 'worker':
+        # схему воркеру готовит ingress
+        engine = make_engine(db_url)
+        migrate(engine)
+        engine.dispose()
+
+    fake = FakeBot(latency=0)
+    dispatcher = main.init(bot_instance=fake, db_url=db_url, temp_dir=str(tmp_path / 'temp'))
+    # настоящие лимиты Telegram растянули бы тест на секунды
+    main.sender.shutdown()
+    main.sender = SendScheduler(workers=2, global_rate=10 ** 6, chat_rate=10 ** 6, chat_burst=10 ** 6,
+                                backoff=0.01)
+    thread = threading.Thread(target=dispatcher.start, daemon=True)
+    thread.start()
+    # stop() до того, как start() поднял пул потоков, зависает на их join
+    while not dispatcher.running:
+        time.sleep(0.01)
+    try:
+        yield main, fake, dispatcher
+    finally:
+        dispatcher.stop()
+        thread.join(5)
+        if main.handlers:
+            main.handlers.shutdown()
+        main.sender.shutdown()
+        if main.preprocessor:
+            main.preprocessor.shutdown()
+        main.Session.remove()
+        main.engine.dispose()
+
+
+@pytest.fixture
+def channel(app):
+    # channel(tenant_id, admins, slug) — канал с админами в базе бота; первый админ его и настроил
+    main = app[0]
+    from sqlhelper import Tenant, TenantMember
+
+    def add(tenant_id, admins, slug=None):
+        slug = slug or 'channel{}'.format(tenant_id)
+        db = main.Session()
+        db.add(Tenant(slug, '@' + slug, admins[0], initialized=True, tenant_id=tenant_id))
+        db.flush()
+        db.add_all(TenantMember(tenant_id, admin_id, is_admin=True) for admin_id in admins)
+        db.commit()
+        main.Session.remove()
+        main.tenant_cache.invalidate()
+    return add
+
+
+@pytest.fixture
+def wait():
+    # wait(predicate) — дождаться условия, которое выполнят потоки бота; возвращает его значение
+    def wait(predicate, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return predicate()
+    return wait
@@ -0,0 +1,60 @@
+import os
+import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from archive import PostArchive
+from sqlhelper import Tenant, Post, ArchiveSegment, make_engine, migrate
+
+OLD = datetime.datetime.utcnow() - datetime.timedelta(days=40)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = make_engine('sqlite:///{}'.format(tmp_path / 'test.db'))
+    migrate(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    session.add(Tenant('main', tenant_id=1))
+    session.flush()
+    for i in range(25):
+        post = Post(100 + i % 3, None, 'пост {}'.format(i), status='published', tenant_id=1)
+        post.created_at = OLD
+        session.add(post)
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_segments_are_files_outside_the_database(db, tmp_path):
+    archive = PostArchive(str(tmp_path / 'archive'), days=30, segment_posts=10)
+
+    # самый новый пост остаётся в posts всегда
+    assert archive.run(db) == 24
+    assert db.query(Post).count() == 1
+
+    segments = db.query(ArchiveSegment).order_by(ArchiveSegment.segment_id).all()
+    assert [s.posts for s in segments] == [10, 10, 4]
+    for segment in segments:
+        with open(tmp_path / 'archive' / segment.path, 'rb') as f:
+            assert len(f.read()) == segment.stored_bytes
+
+    records = archive.find(db, 1, owner_id=100)
+    assert [r['text'] for r in records][:2] == ['пост 21', 'пост 18']
+    assert archive.stats(db)['posts'] == 24
+
+
+def test_failed_transaction_leaves_no_segment_file(db, tmp_path, monkeypatch):
+    archive = PostArchive(str(tmp_path / 'archive'), days=30, segment_posts=10, max_segments=1)
+
+    def broken_commit():
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(db, 'commit', broken_commit)
+    with pytest.raises(RuntimeError):
+        archive.run(db)
+
+    assert os.listdir(tmp_path / 'archive') == []
+    assert db.query(Post).count() == 25
+
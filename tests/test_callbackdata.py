@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import callbackdata
+
+
+def test_round_trip_for_every_action():
+    for action in callbackdata.ACTION_CODES:
+        for post_id in (0, 1, 61, 62, 123456, 2 ** 40):
+            data = callbackdata.encode(action, post_id)
+            assert callbackdata.decode(data) == (action, post_id)
+            # лимит callback_data у Telegram — 64 байта
+            assert len(data.encode()) <= 64
+
+
+def test_encoding_is_compact():
+    assert callbackdata.encode('accept', 123456) == '1aw7e'
+
+
+def test_several_numbers_round_trip():
+    data = callbackdata.encode('page', 2, 123456)
+    assert data == '1p2.w7e'
+    assert callbackdata.decode(data) == ('page', (2, 123456))
+
+
+def test_legacy_json_buttons_still_decode():
+    # так кнопки выглядели у карточек, отправленных до смены формата
+    for action in ('accept', 'decline', 'ban'):
+        data = json.dumps({'post': 42, 'action': action})
+        assert callbackdata.decode(data) == (action, 42)
+
+
+@pytest.mark.parametrize('data', ['', '2a1', '1a', '1z1', '1a!', '[1, 2]', '{"post": 1'])
+def test_garbage_raises_value_error(data):
+    with pytest.raises(ValueError):
+        callbackdata.decode(data)
@@ -0,0 +1,165 @@
+import json
+
+import pytest
+from telegram import Update
+from telegram.error import RetryAfter
+
+import callbackdata
+from sqlhelper import Post, Attachment, ModerationMessage
+from webhook import FakeTelegramClient
+
+ADMINS = (101, 102)
+AUTHOR = 500
+
+
+@pytest.fixture
+def post_id(app, channel):
+    # пост на модерации в канале 1 и его карточка у каждого админа
+    main = app[0]
+    channel(1, ADMINS)
+    db = main.Session()
+    post = Post(AUTHOR, None, 'hello', media_type='text', tenant_id=1)
+    db.add(post)
+    db.flush()
+    db.add_all(ModerationMessage(post.post_id, admin_id, 10 + i) for i, admin_id in enumerate(ADMINS))
+    db.commit()
+    main.Session.remove()
+    return post.post_id
+
+
+def _press(main, fake, dispatcher, action, post_id, admin_id=ADMINS[0]):
+    client = FakeTelegramClient(None)
+    data = client.callback(admin_id, callbackdata.encode(action, post_id), message_id=10)
+    dispatcher.process_update(Update.de_json(data, fake))
+
+
+def _status(main, post_id):
+    db = main.session_factory()
+    try:
+        return db.query(Post.status).filter_by(post_id=post_id).scalar()
+    finally:
+        db.close()
+
+
+def _cards(main, post_id):
+    db = main.session_factory()
+    try:
+        return db.query(ModerationMessage).filter_by(post_id=post_id).count()
+    finally:
+        db.close()
+
+
+def test_decline_closes_every_card(app, post_id, wait):
+    main, fake, dispatcher = app
+
+    _press(main, fake, dispatcher, 'decline', post_id)
+
+    assert wait(lambda: fake.calls['editMessageReplyMarkup'] == len(ADMINS))
+    assert wait(lambda: _cards(main, post_id) == 0)
+    assert _status(main, post_id) == 'declined'
+    assert main.sender.stats()['failed'] == 0
+
+
+def test_accept_queues_publication_and_keeps_cards(app, post_id, wait):
+    main, fake, dispatcher = app
+
+    _press(main, fake, dispatcher, 'accept', post_id)
+
+    assert wait(lambda: fake.calls['editMessageReplyMarkup'] == len(ADMINS))
+    assert wait(lambda: fake.calls['answerCallbackQuery'] == 1)
+    assert _status(main, post_id) == 'publishing'
+    # публикация может сорваться и вернуть пост на модерацию — карточки остаются
+    assert _cards(main, post_id) == len(ADMINS)
+
+
+def test_legacy_json_button_still_works(app, post_id, wait):
+    # карточка, отправленная до смены формата callback_data
+    main, fake, dispatcher = app
+    client = FakeTelegramClient(None)
+    data = client.callback(ADMINS[0], json.dumps({'post': post_id, 'action': 'decline'}), message_id=10)
+    dispatcher.process_update(Update.de_json(data, fake))
+
+    assert wait(lambda: _status(main, post_id) == 'declined')
+    assert wait(lambda: _cards(main, post_id) == 0)
+
+
+def test_second_press_only_reports_status(app, post_id, wait):
+    main, fake, dispatcher = app
+
+    _press(main, fake, dispatcher, 'decline', post_id)
+    assert wait(lambda: _status(main, post_id) == 'declined')
+    _press(main, fake, dispatcher, 'accept', post_id, admin_id=ADMINS[1])
+
+    assert wait(lambda: fake.calls['answerCallbackQuery'] == 2)
+    assert _status(main, post_id) == 'declined'
+
+
+def test_stranger_is_not_authorized(app, post_id, wait):
+    main, fake, dispatcher = app
+
+    _press(main, fake, dispatcher, 'decline', post_id, admin_id=999)
+
+    assert wait(lambda: fake.calls['answerCallbackQuery'] == 1)
+    assert _status(main, post_id) == 'pending'
+
+
+def test_album_card_retry_does_not_resend_the_album(app, post_id, wait, monkeypatch):
+    main, fake, dispatcher = app
+    db = main.Session()
+    post = db.query(Post).filter_by(post_id=post_id).one()
+    post.media_type = 'album'
+    db.add_all([Attachment(post_id, 0, file_id='p0', media_type='photo'),
+                Attachment(post_id, 1, file_id='p1', media_type='photo')])
+    db.commit()
+    attachments = main._load_attachments(db, post)
+    main.Session.remove()
+
+    # кнопки под альбомом упираются во флуд-лимит один раз
+    send_message = fake.send_message
+    failures = [RetryAfter(0.05)]
+
+    def flaky_send_message(chat_id, text, **kwargs):
+        if failures:
+            raise failures.pop()
+        return send_message(chat_id, text, **kwargs)
+
+    monkeypatch.setattr(fake, 'send_message', flaky_send_message)
+    main.sender.submit(ADMINS[0], main._send_card, fake, ADMINS[0], post, 'card',
+                       main._moderation_markup(post_id), attachments=attachments)
+
+    assert wait(lambda: fake.calls['sendMessage'] == 1)
+    assert fake.calls['sendMediaGroup'] == 1
+    assert wait(lambda: _cards(main, post_id) == len(ADMINS) + 1)
+
+
+def test_page_button_lists_the_channel_it_was_sent_for(app, post_id, channel, wait):
+    # админ двух каналов листает очередь второго, хотя сейчас пишет в первый
+    main, fake, dispatcher = app
+    channel(2, [ADMINS[0]])
+    db = main.Session()
+    post = Post(AUTHOR, None, 'во второй канал', media_type='text', tenant_id=2)
+    db.add(post)
+    db.commit()
+    second_id = post.post_id
+    main.Session.remove()
+
+    client = FakeTelegramClient(None)
+    data = client.callback(ADMINS[0], callbackdata.encode('page', 2, 0), message_id=10)
+    dispatcher.process_update(Update.de_json(data, fake))
+
+    # calls считается до ответа FakeBot, deliveries — после
+    assert wait(lambda: fake.deliveries)
+    [(_, chat_id, text)] = fake.deliveries
+    assert chat_id == ADMINS[0]
+    assert '#{}'.format(second_id) in text and '#{}'.format(post_id) not in text
+
+
+def test_page_button_of_a_foreign_channel_is_not_authorized(app, post_id, wait):
+    main, fake, dispatcher = app
+
+    client = FakeTelegramClient(None)
+    data = client.callback(ADMINS[0], callbackdata.encode('page', 7, 0), message_id=10)
+    dispatcher.process_update(Update.de_json(data, fake))
+
+    assert wait(lambda: fake.calls['answerCallbackQuery'] == 1)
+    assert fake.calls['sendMessage'] == 0
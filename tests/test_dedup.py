@@ -0,0 +1,86 @@
+import io
+import time
+
+from PIL import Image
+from telegram import Update
+
+from dedup import DuplicateIndex, perceptual_hash, distance, to_signed, to_unsigned
+from sqlhelper import Post
+from webhook import FakeTelegramClient
+
+
+def _picture(side=256, quality=95):
+    # градиент с тёмным квадратом — у dHash есть что сравнивать; рисунок не зависит от размера
+    img = Image.new('L', (side, side))
+    img.putdata([20 if side // 4 < x < side // 2 and side // 4 < y < side // 2 else (x + y) * 255 // (2 * side)
+                 for y in range(side) for x in range(side)])
+    buf = io.BytesIO()
+    img.convert('RGB').save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def test_recompressed_and_resized_picture_keeps_its_hash():
+    original = perceptual_hash(_picture())
+    assert original is not None
+    assert distance(original, perceptual_hash(_picture(quality=30))) <= 6
+    assert distance(original, perceptual_hash(_picture(side=128))) <= 6
+    assert perceptual_hash(b'not an image') is None
+
+
+def test_signed_round_trip():
+    for phash in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        assert to_unsigned(to_signed(phash)) == phash
+        assert -(1 << 63) <= to_signed(phash) < 1 << 63
+
+
+def test_index_finds_exact_and_near_copies_within_a_channel():
+    index = DuplicateIndex(max_distance=4)
+    index.add(1, file_unique_id='u1', sha256='s1', phash=0b1111, tenant_id=1)
+    index.add(2, phash=0b1111 << 20, tenant_id=1)
+
+    assert index.find(file_unique_id='u1', tenant_id=1) == [(1, 0, True)]
+    assert index.find(sha256='s1', tenant_id=1) == [(1, 0, True)]
+    # три бита разницы — похожая, но не точная копия
+    assert index.find(phash=0b1000, tenant_id=1) == [(1, 3, False)]
+    # точное совпадение идёт раньше похожего
+    assert index.find(file_unique_id='u1', phash=(0b1111 << 20) | 1, tenant_id=1) == [(1, 0, True), (2, 1, False)]
+    assert index.find(phash=(1 << 64) - 1, tenant_id=1) == []
+
+
+def test_channels_do_not_share_duplicates():
+    index = DuplicateIndex()
+    index.add(1, file_unique_id='u1', phash=42, tenant_id=1)
+
+    assert index.find(file_unique_id='u1', phash=42, tenant_id=2) == []
+
+
+def test_old_hashes_fall_out_of_the_window():
+    index = DuplicateIndex(window=60)
+    index.add(1, file_unique_id='u1', phash=42, added_at=time.time() - 120, tenant_id=1)
+
+    assert index.find(file_unique_id='u1', phash=42, tenant_id=1) == []
+
+
+def test_same_photo_twice_is_merged_into_the_first_post(app, channel, wait):
+    main, fake, dispatcher = app
+    channel(1, [101])
+    client = FakeTelegramClient(None)
+    photo = [{'file_id': 'p1', 'file_unique_id': 'same', 'width': 100, 'height': 100}]
+
+    def posts():
+        db = main.session_factory()
+        try:
+            return db.query(Post).order_by(Post.post_id).all()
+        finally:
+            db.close()
+
+    for _ in range(2):
+        dispatcher.process_update(Update.de_json(client.message(500, None, photo=photo), fake))
+
+    assert wait(lambda: len(posts()) == 2)
+    first, second = posts()
+    assert (first.status, second.status) == ('pending', 'duplicate')
+    assert second.duplicate_of == first.post_id
+    # админам ушла только первая копия, второму отправителю — ответ, что пост уже ждёт решения
+    assert wait(lambda: any(d[2] and 'уже ждёт модерации' in d[2] for d in fake.deliveries))
+    assert wait(lambda: fake.calls['sendPhoto'] == 1)
@@ -0,0 +1,62 @@
+from sqlhelper import Tenant, Post
+
+ADMIN = 101
+
+
+def _submit(main, count, tenant_id=1, status='pending'):
+    db = main.Session()
+    db.add_all(Post(500, None, 'пост', status=status, tenant_id=tenant_id) for _ in range(count))
+    db.commit()
+    main.Session.remove()
+
+
+def _digests(fake):
+    return [d[2] for d in fake.deliveries if d[1] == ADMIN and d[2].startswith('📬')]
+
+
+def test_queue_pages_follow_post_ids(app, channel, monkeypatch):
+    main, fake, dispatcher = app
+    monkeypatch.setattr(main, 'QUEUE_PAGE_SIZE', 10)
+    channel(1, [ADMIN])
+    channel(2, [102])
+    _submit(main, 25)
+    # чужой канал и разобранные посты в очередь не попадают
+    _submit(main, 3, tenant_id=2)
+    _submit(main, 2, status='declined')
+
+    db = main.Session()
+    pages, after_id = [], 0
+    while after_id is not None:
+        page = main._queue_page(db, 1, after_id)
+        pages.append(page)
+        after_id = page['next']
+    main.Session.remove()
+
+    assert [len(p['posts']) for p in pages] == [10, 10, 5]
+    assert [p['first'] for p in pages] == [True, False, False]
+    assert {p['total'] for p in pages} == {25, 15, 5}
+    ids = [post.post_id for p in pages for post in p['posts']]
+    assert ids == sorted(ids) and len(set(ids)) == 25
+    assert pages[0]['next'] == ids[9]
+
+
+def test_digest_sends_only_new_posts(app, channel, wait):
+    main, fake, dispatcher = app
+    channel(1, [ADMIN])
+    digest = main.unit_of_work(main.send_digest)
+
+    _submit(main, 3)
+    digest(None)
+    assert wait(lambda: len(_digests(fake)) == 1)
+    assert _digests(fake)[0].startswith('📬 Новые предложки: 3')
+
+    # ничего нового — ничего и не шлём
+    digest(None)
+    _submit(main, 2)
+    digest(None)
+    assert wait(lambda: len(_digests(fake)) == 2)
+    assert _digests(fake)[1].startswith('📬 Новые предложки: 2')
+
+    db = main.Session()
+    assert db.get(Tenant, 1).digest_cursor == db.query(Post).count()
+    main.Session.remove()
@@ -0,0 +1,64 @@
+import time
+import random
+import threading
+
+from handlerpool import HandlerPool
+
+
+def test_same_key_runs_in_order():
+    pool = HandlerPool(workers=8)
+    done = {user: [] for user in range(4)}
+
+    def handle(user, n):
+        time.sleep(random.random() / 200)
+        done[user].append(n)
+
+    for n in range(50):
+        for user in done:
+            pool.submit(user, handle, user, n)
+    pool.shutdown()
+
+    for seen in done.values():
+        assert seen == list(range(50))
+
+
+def test_different_keys_run_in_parallel():
+    pool = HandlerPool(workers=4)
+    barrier = threading.Barrier(4, timeout=5)
+    for user in range(4):
+        pool.submit(user, barrier.wait)
+    pool.shutdown()
+
+    assert pool.stats()['failed'] == 0
+
+
+def test_submit_blocks_when_backlog_is_full():
+    pool = HandlerPool(workers=2, max_pending=3)
+    release = threading.Event()
+    for user in range(3):
+        pool.submit(user, release.wait)
+
+    submitted = threading.Event()
+    threading.Thread(target=lambda: (pool.submit(99, lambda: None), submitted.set()), daemon=True).start()
+    assert not submitted.wait(0.2)
+    assert pool.stats()['waits'] == 1
+
+    release.set()
+    assert submitted.wait(5)
+    pool.shutdown()
+    assert pool.stats()['pending'] == 0
+
+
+def test_failed_handler_does_not_stall_its_user():
+    pool = HandlerPool(workers=2)
+    seen = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    pool.submit(1, fail)
+    pool.submit(1, seen.append, 'next')
+    pool.shutdown()
+
+    assert seen == ['next']
+    assert pool.stats()['failed'] == 1
@@ -0,0 +1,97 @@
+import time
+
+from telegram import Update
+
+from sqlhelper import Post
+from webhook import FakeTelegramClient
+
+AUTHOR = 500
+
+
+def _posts(main):
+    db = main.session_factory()
+    try:
+        return db.query(Post).order_by(Post.post_id).all()
+    finally:
+        db.close()
+
+
+def _send(app, client, text=None, **fields):
+    main, fake, dispatcher = app
+    dispatcher.process_update(Update.de_json(client.message(AUTHOR, text, **fields), fake))
+
+
+def _photo(file_id, side=100):
+    return [{'file_id': file_id, 'file_unique_id': file_id, 'width': side, 'height': side}]
+
+
+def test_user_updates_are_handled_in_order(app, channel, wait):
+    # ответ на /start медленный, а пост пришёл сразу следом — он всё равно должен попасть
+    # в канал из ссылки и после поста, отправленного раньше
+    main, fake, dispatcher = app
+    fake.latency = 0.05
+    channel(1, [101], slug='main')
+    channel(2, [102], slug='second')
+    client = FakeTelegramClient(None)
+
+    for text in ('первый', '/start second', 'второй', 'третий'):
+        _send(app, client, text=text)
+
+    assert wait(lambda: len(_posts(main)) == 3)
+    posts = _posts(main)
+    assert [p.text for p in posts] == ['первый', 'второй', 'третий']
+    assert [p.tenant_id for p in posts] == [1, 2, 2]
+
+
+def test_document_is_sent_by_file_id_after_reading_its_head(app, channel, wait):
+    main, fake, dispatcher = app
+    channel(1, [101])
+    client = FakeTelegramClient(None)
+    document = {'file_id': 'doc-1', 'file_unique_id': 'doc-1', 'file_name': 'report.pdf', 'file_size': 200 * 1024}
+
+    _send(app, client, document=document)
+
+    assert wait(lambda: _posts(main))
+    [post] = _posts(main)
+    assert (post.media_type, post.file_id, post.attachment_path) == ('document', 'doc-1', None)
+    assert main.transfer.stats()['head_reads'] == 1
+
+
+def test_album_parts_delayed_by_slow_api_stay_one_post(app, channel, wait):
+    # каждая часть ждёт getFile и превью предыдущей — последняя доходит до сборщика позже окна от первой
+    main, fake, dispatcher = app
+    fake.latency = 0.1
+    main.albums._window = 0.3
+    channel(1, [101])
+    client = FakeTelegramClient(None)
+    # альбомы собирает задача очереди задач диспетчера
+    dispatcher.job_queue.start()
+
+    for i in range(4):
+        _send(app, client, media_group_id='g1', caption='альбом' if i == 0 else None,
+              photo=_photo('p{}'.format(i)))
+
+    assert wait(lambda: _posts(main))
+    time.sleep(1)
+    dispatcher.job_queue.stop()
+
+    posts = _posts(main)
+    assert [(p.media_type, p.text) for p in posts] == [('album', 'альбом')]
+
+
+def test_photo_is_downloaded_only_when_it_must_change(app, channel, wait, monkeypatch):
+    main, fake, dispatcher = app
+    channel(1, [101])
+    client = FakeTelegramClient(None)
+
+    # обычное фото уходит по file_id, большое скачивается, чтобы его ужать
+    _send(app, client, photo=_photo('small', 1280))
+    _send(app, client, photo=_photo('large', main.MAX_PHOTO_SIDE + 1))
+    assert wait(lambda: len(_posts(main)) == 2)
+    assert main.transfer.stats()['downloaded'] == fake.file_size
+
+    # с водяным знаком скачивается любое фото
+    monkeypatch.setattr(main, 'WATERMARK', '@main')
+    _send(app, client, photo=_photo('marked', 1280))
+    assert wait(lambda: len(_posts(main)) == 3)
+    assert main.transfer.stats()['downloaded'] == 2 * fake.file_size
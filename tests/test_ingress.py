@@ -0,0 +1,69 @@
+from telegram import Update
+
+from sqlhelper import TenantMember
+from webhook import FakeTelegramClient
+
+ADMIN = 101
+AUTHOR = 500
+
+
+def test_start_links_are_rate_limited(app, channel, wait):
+    # /start <slug> проходит мимо бана, но не мимо личного лимита
+    main, fake, dispatcher = app
+    channel(1, [ADMIN], slug='main')
+    client = FakeTelegramClient(None)
+
+    for _ in range(main.USER_BURST + 5):
+        dispatcher.process_update(Update.de_json(client.message(AUTHOR, '/start main'), fake))
+
+    stats = main.ingress.stats()
+    assert (stats['passed'], stats['shed_limited']) == (main.USER_BURST, 5)
+    # ответы получили только пропущенные и одно предупреждение о лимите
+    assert wait(lambda: fake.calls['sendMessage'] == main.USER_BURST + 1)
+
+
+def test_banned_user_is_shed_before_the_file_is_fetched(app, channel, wait):
+    main, fake, dispatcher = app
+    channel(1, [ADMIN], slug='main')
+    client = FakeTelegramClient(None)
+    dispatcher.process_update(Update.de_json(client.message(AUTHOR, '/start main'), fake))
+
+    db = main.Session()
+    db.add(TenantMember(1, AUTHOR, banned=True))
+    db.commit()
+    main.Session.remove()
+    main.tenant_cache.invalidate()
+
+    photo = [{'file_id': 'p1', 'file_unique_id': 'p1', 'width': 100, 'height': 100}]
+    dispatcher.process_update(Update.de_json(client.message(AUTHOR, None, photo=photo), fake))
+
+    assert main.ingress.stats()['shed_banned'] == 1
+    assert fake.calls['getFile'] == 0
+    # ответ получил только /start, забаненному молчим
+    assert wait(lambda: fake.calls['sendMessage'] == 1)
+
+
+def test_flood_is_limited_with_one_warning(app, channel, wait):
+    main, fake, dispatcher = app
+    channel(1, [ADMIN], slug='main')
+    client = FakeTelegramClient(None)
+
+    for i in range(main.USER_BURST + 3):
+        dispatcher.process_update(Update.de_json(client.message(AUTHOR, 'пост {}'.format(i)), fake))
+
+    stats = main.ingress.stats()
+    assert (stats['passed'], stats['shed_limited']) == (main.USER_BURST, 3)
+    # остальные сообщения дошли до обработчиков, а о лимите предупредили один раз
+    assert wait(lambda: sum(1 for d in fake.deliveries if d[1] == AUTHOR and 'Слишком много' in d[2]) == 1)
+
+
+def test_admins_are_not_limited(app, channel):
+    main, fake, dispatcher = app
+    channel(1, [ADMIN], slug='main')
+    client = FakeTelegramClient(None)
+
+    for i in range(main.USER_BURST + 3):
+        dispatcher.process_update(Update.de_json(client.message(ADMIN, '/perf'), fake))
+
+    stats = main.ingress.stats()
+    assert (stats['passed'], stats['shed_banned'], stats['shed_limited']) == (0, 0, 0)
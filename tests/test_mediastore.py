@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+
+from mediastore import MediaStore, QuotaExceeded, GRACE_PERIOD
+
+
+def _write(path, data=b'x', age=GRACE_PERIOD * 2):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    old = time.time() - age
+    os.utime(path, (old, old))
+    return path
+
+
+def test_sweep_removes_unreferenced_store_files(tmp_path):
+    store = MediaStore(str(tmp_path))
+    src = _write(str(tmp_path / 'incoming' / '1_a.jpg'), b'orphan')
+    stored = store.put(src)
+    old = time.time() - GRACE_PERIOD * 2
+    os.utime(stored, (old, old))
+
+    assert store.sweep([]) == 1
+    assert not os.path.exists(stored)
+
+
+def test_sweep_keeps_referenced_and_fresh_files(tmp_path):
+    store = MediaStore(str(tmp_path))
+    referenced = store.put(_write(str(tmp_path / 'incoming' / '1_a.jpg'), b'live'))
+    os.utime(referenced, (time.time() - GRACE_PERIOD * 2,) * 2)
+    fresh = store.put(_write(str(tmp_path / 'incoming' / '2_b.jpg'), b'fresh', age=0))
+
+    assert store.sweep([referenced]) == 0
+    assert os.path.exists(referenced) and os.path.exists(fresh)
+
+
+def test_sweep_keeps_legacy_temp_files(tmp_path):
+    # temp/<число>_<имя> клали версии бота до хранилища, на них ссылаются старые посты
+    store = MediaStore(str(tmp_path))
+    legacy = _write(str(tmp_path / '123_photo.jpg'))
+    other = _write(str(tmp_path / 'ab' / 'notes.txt'))
+
+    assert store.sweep([]) == 0
+    assert os.path.exists(legacy) and os.path.exists(other)
+
+
+def test_sweep_removes_stale_incoming(tmp_path):
+    store = MediaStore(str(tmp_path))
+    stale = _write(str(tmp_path / 'incoming' / '1_a.jpg'), age=7200)
+
+    assert store.sweep([]) == 1
+    assert not os.path.exists(stale)
+
+
+def test_quota_keeps_live_files_and_refuses_downloads(tmp_path):
+    store = MediaStore(str(tmp_path), quota_bytes=10)
+    live = store.put(_write(str(tmp_path / 'incoming' / '1_a.jpg'), b'x' * 8))
+    other = store.put(_write(str(tmp_path / 'incoming' / '2_b.jpg'), b'y' * 8))
+    old = time.time() - GRACE_PERIOD * 2
+    os.utime(live, (old, old))
+    os.utime(other, (old, old))
+
+    # оба файла нужны постам на модерации: квота превышена, но удалять их нельзя
+    assert store.sweep([live, other]) == 0
+    assert os.path.exists(live) and os.path.exists(other)
+    with pytest.raises(QuotaExceeded):
+        store.check_quota(1)
+    assert store.stats()['refused'] == 1
+
+    # пост разобран — его файл удаляется, и место для новых снова есть
+    assert store.sweep([live]) == 1
+    store.check_quota(2)
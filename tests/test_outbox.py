@@ -0,0 +1,121 @@
+import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+from telegram.error import RetryAfter
+
+from outbox import PublishOutbox
+from sqlhelper import Tenant, Post, OutboxEntry, make_engine, migrate
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = make_engine('sqlite:///{}'.format(tmp_path / 'test.db'))
+    migrate(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    session.add_all([Tenant('first', tenant_id=1), Tenant('second', tenant_id=2)])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _accept(db, outbox, tenant_id):
+    post = Post(100, None, 'пост', status='publishing', tenant_id=tenant_id)
+    db.add(post)
+    db.flush()
+    outbox.enqueue(db, post.post_id)
+    db.commit()
+    return post.post_id
+
+
+def _make_due(db):
+    db.query(OutboxEntry).update({'next_attempt_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)})
+    db.commit()
+
+
+def _status(db, post_id):
+    return db.query(Post.status).filter_by(post_id=post_id).scalar()
+
+
+def test_failed_publish_backs_off_exponentially(db):
+    published = []
+    failures = [RuntimeError('boom'), RuntimeError('boom again')]
+
+    def publish(db, post):
+        if failures:
+            raise failures.pop(0)
+        published.append(post.post_id)
+
+    outbox = PublishOutbox(publish, backoff=10)
+    post_id = _accept(db, outbox, 1)
+
+    delays = []
+    for _ in range(2):
+        started = datetime.datetime.utcnow()
+        assert outbox.drain(db) == 0
+        entry = db.query(OutboxEntry).one()
+        delays.append((entry.next_attempt_at - started).total_seconds())
+        # отложенная запись до срока не берётся
+        assert outbox.drain(db) == 0
+        _make_due(db)
+
+    assert entry.attempts == 2
+    assert entry.last_error == 'boom again'
+    assert 9 <= delays[0] <= 11 and 19 <= delays[1] <= 21
+
+    assert outbox.drain(db) == 1
+    assert published == [post_id]
+    assert _status(db, post_id) == 'published'
+    assert db.query(OutboxEntry).count() == 0
+    assert outbox.stats(db)['retried'] == 2
+
+
+def test_retry_after_pauses_only_that_channel(db):
+    published = []
+    flooded = []
+
+    def publish(db, post):
+        if post.tenant_id == 1 and not flooded:
+            flooded.append(post.post_id)
+            raise RetryAfter(30)
+        published.append(post.post_id)
+
+    outbox = PublishOutbox(publish)
+    first = [_accept(db, outbox, 1) for _ in range(2)]
+    second = [_accept(db, outbox, 2) for _ in range(2)]
+
+    # первый канал встал на паузу, второй публикуется дальше
+    assert outbox.drain(db) == 2
+    assert published == second
+    assert [_status(db, post_id) for post_id in first] == ['publishing', 'publishing']
+
+    # RetryAfter не считается попыткой
+    entry = db.query(OutboxEntry).filter_by(post_id=first[0]).one()
+    assert entry.attempts == 0
+    assert entry.next_attempt_at > datetime.datetime.utcnow() + datetime.timedelta(seconds=25)
+    assert outbox.stats(db)['flood_waits'] == 1
+
+    # пока пауза не кончилась, даже наступивший срок не выпускает посты канала
+    _make_due(db)
+    assert outbox.drain(db) == 0
+
+
+def test_gives_up_and_returns_post_to_moderation(db):
+    gave_up = []
+
+    def publish(db, post):
+        raise RuntimeError('channel is gone')
+
+    outbox = PublishOutbox(publish, max_attempts=3, on_gave_up=lambda db, post, error: gave_up.append(
+        (post.post_id, str(error))))
+    post_id = _accept(db, outbox, 1)
+
+    for _ in range(3):
+        outbox.drain(db)
+        _make_due(db)
+
+    assert gave_up == [(post_id, 'channel is gone')]
+    assert _status(db, post_id) == 'pending'
+    assert db.query(OutboxEntry).count() == 0
+    assert outbox.stats(db)['gave_up'] == 1
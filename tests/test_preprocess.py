@@ -0,0 +1,72 @@
+import hashlib
+import os
+from types import SimpleNamespace
+
+from mediastore import MediaStore
+from preprocess import sniff, HEAD_SIZE, _mp3_frame_length
+from transfer import Transfer
+
+# MPEG-1 Layer III, 128 кбит/с, 44.1 кГц: кадр 417 байт
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+
+
+def _mp3(frames=3):
+    frame = MP3_HEADER + bytes(_mp3_frame_length(MP3_HEADER) - len(MP3_HEADER))
+    return frame * frames
+
+
+def test_sniff_known_formats():
+    assert sniff(b'\xff\xd8\xff\xe0' + bytes(60)) == ('photo', '.jpg')
+    assert sniff(b'\x89PNG\r\n\x1a\n' + bytes(56)) == ('photo', '.png')
+    assert sniff(b'ID3\x04' + bytes(60)) == ('audio', '.mp3')
+    assert sniff(_mp3()[:HEAD_SIZE]) == ('audio', '.mp3')
+
+
+def test_sniff_utf16_text_is_not_mp3():
+    assert sniff('hello'.encode('utf-16')) == ('document', None)
+    assert sniff('hello'.encode('utf-16')[:HEAD_SIZE] * 100) == ('document', None)
+
+
+def test_sniff_requires_the_next_frame():
+    # одиночный заголовок, за которым на месте следующего кадра мусор — не MP3
+    assert sniff(MP3_HEADER + bytes(1000)) == ('document', None)
+    assert sniff(bytes([0xFF, 0xFF, 0xFF, 0xFF]) * 300) == ('document', None)
+
+
+def test_read_head_reads_only_the_head(tmp_path):
+    # локальный Bot API сервер отдаёт путь к файлу на своём диске
+    path = tmp_path / 'big.bin'
+    path.write_bytes(b'%PDF-1.7' + os.urandom(1024 * 1024))
+
+    def download(*args, **kwargs):
+        raise AssertionError('full download')
+
+    tg_file = SimpleNamespace(file_path=str(path), file_size=path.stat().st_size, download=download)
+    transfer = Transfer()
+
+    head = transfer.read_head(tg_file, HEAD_SIZE)
+    assert head == path.read_bytes()[:HEAD_SIZE]
+    assert sniff(head) == ('document', None)
+    assert transfer.stats()['head_reads'] == 1
+    assert transfer.stats()['downloaded'] == 0
+
+
+def test_small_download_is_reused_from_memory(tmp_path):
+    data = b'\xff\xd8\xff\xe0' + os.urandom(4096)
+    tg_file = SimpleNamespace(file_path='photo.jpg', file_size=len(data), download=lambda out: out.write(data))
+    transfer = Transfer()
+    store = MediaStore(str(tmp_path))
+    path = store.incoming_path('photo.jpg')
+
+    assert transfer.download(tg_file, path) == len(data)
+    stored = store.put(path, data=transfer.cached(path))
+    transfer.moved(path, stored)
+
+    # файл на диске для поста есть, но хэш и отправка обошлись без чтения с диска
+    assert os.path.basename(stored) == hashlib.sha256(data).hexdigest() + '.jpg'
+    with open(stored, 'rb') as f:
+        assert f.read() == data
+    with transfer.open(stored) as media:
+        assert media.read() == data
+    assert transfer.stats()['disk_reads'] == 0
+    assert transfer.cached(path) is None
@@ -0,0 +1,30 @@
+import pytest
+
+from workqueue import QueueConsumer
+
+
+def test_readiness_follows_the_intake(app, monkeypatch):
+    main, fake, dispatcher = app
+    monkeypatch.setattr(main, 'intake', None)
+    assert main._readiness() == (False, 'not receiving updates')
+
+    # воркер: апдейты приходят из очереди в базе, Updater не запущен
+    consumer = QueueConsumer(main.WorkQueue(), main.session_factory, lambda data: None, threads=1, poll=0.05)
+    consumer.start()
+    monkeypatch.setattr(main, 'intake', consumer)
+    assert main._readiness() == (True, 'ok')
+
+    consumer.stop()
+    assert main._readiness() == (False, 'not receiving updates')
+
+
+def test_webhook_without_secret_refuses_to_start(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, 'MODE', 'webhook')
+    monkeypatch.setattr(main, 'ROLE', 'all')
+    monkeypatch.setattr(main, 'WEBHOOK_SECRET', None)
+    monkeypatch.setattr(main, 'WEBHOOK_INSECURE', False)
+    with pytest.raises(SystemExit):
+        main.run()
+    assert main.webhook is None
@@ -0,0 +1,32 @@
+from sqlalchemy import func
+from telegram import Update
+
+from sqlhelper import Post, PostStat
+from webhook import FakeTelegramClient
+
+ADMIN = 101
+AUTHOR = 500
+
+
+def _query(main, *columns, **filters):
+    db = main.session_factory()
+    try:
+        return db.query(*columns).filter_by(**filters).one()
+    finally:
+        db.close()
+
+
+def test_ban_counts_declined_posts(app, channel, wait):
+    main, fake, dispatcher = app
+    channel(1, [ADMIN])
+
+    client = FakeTelegramClient(None)
+    for i in range(3):
+        dispatcher.process_update(Update.de_json(client.message(AUTHOR, 'пост {}'.format(i)), fake))
+    assert wait(lambda: _query(main, func.count(Post.post_id), status='pending')[0] == 3)
+
+    dispatcher.process_update(Update.de_json(client.message(ADMIN, '/ban {}'.format(AUTHOR)), fake))
+    assert wait(lambda: _query(main, func.count(Post.post_id), status='declined')[0] == 3)
+
+    submitted, declined = _query(main, func.sum(PostStat.submitted), func.sum(PostStat.declined), tenant_id=1)
+    assert (submitted, declined) == (3, 3)
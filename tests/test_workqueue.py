@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+from telegram import Update
+
+from sqlhelper import Post, QueuedUpdate
+from webhook import FakeTelegramClient
+from workqueue import QueueConsumer
+
+ADMIN = 101
+AUTHOR = 500
+
+pytestmark = pytest.mark.parametrize('app', ['worker'], indirect=True)
+
+
+def _rows(main):
+    db = main.session_factory()
+    try:
+        return db.query(QueuedUpdate).order_by(QueuedUpdate.id).all()
+    finally:
+        db.close()
+
+
+def _posts(main):
+    db = main.session_factory()
+    try:
+        return [p.text for p in db.query(Post).order_by(Post.post_id)]
+    finally:
+        db.close()
+
+
+def _consume(main, fake, *texts):
+    client = FakeTelegramClient(None)
+    db = main.Session()
+    for text in texts:
+        main.work_queue.put(db, Update.de_json(client.message(AUTHOR, text), fake))
+    main.Session.remove()
+    consumer = QueueConsumer(main.work_queue, main.session_factory, main.process_queued, threads=1, poll=0.05)
+    consumer.start()
+    return consumer
+
+
+def test_failed_handler_is_retried_before_later_updates(app, channel, wait, monkeypatch):
+    main, fake, dispatcher = app
+    channel(1, [ADMIN])
+    main.work_queue.retry_delay = 0.2
+    send = main.send_to_admin_with_buttons
+    calls = []
+
+    def flaky(update, context, **kwargs):
+        calls.append(kwargs['text'])
+        if len(calls) == 1:
+            raise OperationalError('INSERT', {}, Exception('database is locked'))
+        send(update, context, **kwargs)
+
+    monkeypatch.setattr(main, 'send_to_admin_with_buttons', flaky)
+    consumer = _consume(main, fake, 'первый', 'второй')
+    try:
+        # первый апдейт падает и повторяется, второй ждёт его и не обгоняет
+        assert wait(lambda: all(r.done for r in _rows(main)))
+    finally:
+        consumer.stop()
+
+    first, second = _rows(main)
+    assert (first.attempts, first.error) == (2, None)
+    assert (second.attempts, second.error) == (1, None)
+    assert calls == ['первый', 'первый', 'второй']
+    assert _posts(main) == ['первый', 'второй']
+    assert main.work_queue.stats(main.Session())['retried'] == 1
+
+
+def test_update_is_set_aside_after_max_attempts(app, channel, wait, monkeypatch):
+    main, fake, dispatcher = app
+    channel(1, [ADMIN])
+    main.work_queue.retry_delay = 0
+    main.work_queue.max_attempts = 3
+
+    def broken(update, context, **kwargs):
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(main, 'send_to_admin_with_buttons', broken)
+    consumer = _consume(main, fake, 'пост')
+    try:
+        assert wait(lambda: _rows(main)[0].done)
+    finally:
+        consumer.stop()
+
+    [row] = _rows(main)
+    assert row.attempts == 3
+    assert row.error == 'gave up after 3 attempts'
+    assert _posts(main) == []
+    assert main.work_queue.stats(main.Session())['failed'] == 1
@@ -0,0 +1,229 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib import request as urlrequest
+
+# Bot API отдаёт на скачивание файлы до 20 МБ; с локальным Bot API сервером лимит можно поднять
+MAX_FILE_BYTES = 20 * 1024 * 1024
+# файлы не больше этого держим в памяти целиком и переиспользуем между отправками
+SMALL_FILE_BYTES = 1024 * 1024
+MEMORY_BYTES = 64 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+MAX_FILE_IDS = 10000
+TIMEOUT = 60
+
+
+class FileTooLarge(Exception):
+    def __init__(self, size, limit):
+        super().__init__('File is {} bytes, limit is {}'.format(size, limit))
+        self.size = size
+        self.limit = limit
+
+
+class Transfer:
+    # Скачивание и загрузка локальных файлов. Маленькие файлы скачиваются в память и при рассылке
+    # отдаются из LRU-кэша байтов, большие пишутся на диск кусками по CHUNK_SIZE. После первой загрузки
+    # файла в Telegram запоминаем его file_id, и остальные админы получают файл без повторной загрузки.
+    # Все дескрипторы закрываются в контекстных менеджерах, и gauge open_handles это показывает
+    def __init__(self, max_file_bytes=MAX_FILE_BYTES, small_file_bytes=SMALL_FILE_BYTES,
+                 memory_bytes=MEMORY_BYTES, timeout=TIMEOUT):
+        self.max_file_bytes = max_file_bytes
+        self.small_file_bytes = small_file_bytes
+        self.memory_bytes = memory_bytes
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._blobs = OrderedDict()
+        self._blob_bytes = 0
+        self._file_ids = OrderedDict()
+        self._upload_locks = {}
+
+        self.open_handles = 0
+        self.memory_hits = 0
+        self.disk_reads = 0
+        self.file_id_hits = 0
+        self.downloaded = 0
+        self.rejected = 0
+        self.head_reads = 0
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    # ---------- скачивание ----------
+
+    def download(self, tg_file, path):
+        # скачивает telegram.File в path; FileTooLarge — если файл больше лимита
+        size = tg_file.file_size
+        if size and size > self.max_file_bytes:
+            self._count('rejected')
+            raise FileTooLarge(size, self.max_file_bytes)
+
+        try:
+            url = tg_file.file_path or ''
+            if (size and size <= self.small_file_bytes) or not url.startswith(('http://', 'https://')):
+                # маленький файл (или не по HTTP, как у локального Bot API) — одним куском через память
+                buf = io.BytesIO()
+                tg_file.download(out=buf)
+                written = self.check_size(buf.tell())
+                with open(path, 'wb') as f:
+                    f.write(buf.getbuffer())
+                if written <= self.small_file_bytes:
+                    # байты уже в памяти: хэш, превью и рассылка возьмут их отсюда, а не с диска
+                    self._remember_blob(path, buf.getvalue())
+            else:
+                written = self._stream(url, path)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+        self._count('downloaded', written)
+        return written
+
+    def read_head(self, tg_file, size):
+        # первые size байт файла — узнать тип по содержимому, не скачивая файл целиком
+        url = tg_file.file_path or ''
+        if url.startswith(('http://', 'https://')):
+            # Range просит только голову; если сервер его не понял, читаем size байт и закрываем соединение
+            req = urlrequest.Request(url, headers={'Range': 'bytes=0-{}'.format(size - 1)})
+            with urlrequest.urlopen(req, timeout=self.timeout) as resp:
+                head = resp.read(size)
+        elif os.path.isabs(url) and os.path.exists(url):
+            # локальный Bot API сервер отдаёт путь к файлу на своём диске
+            with open(url, 'rb') as f:
+                head = f.read(size)
+        else:
+            buf = io.BytesIO()
+            tg_file.download(out=buf)
+            head = buf.getvalue()[:size]
+        self._count('head_reads')
+        return head
+
+    def check_size(self, size):
+        if size > self.max_file_bytes:
+            self._count('rejected')
+            raise FileTooLarge(size, self.max_file_bytes)
+        return size
+
+    def _stream(self, url, path):
+        # python-telegram-bot 13 держит скачиваемый файл в памяти целиком, поэтому большие качаем сами
+        written = 0
+        with urlrequest.urlopen(url, timeout=self.timeout) as resp, open(path, 'wb') as f:
+            while True:
+                chunk = resp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written = self.check_size(written + len(chunk))
+                f.write(chunk)
+        return written
+
+    # ---------- загрузка ----------
+
+    def _blob(self, path):
+        with self._lock:
+            data = self._blobs.get(path)
+            if data is not None:
+                self._blobs.move_to_end(path)
+                self.memory_hits += 1
+            return data
+
+    def _remember_blob(self, path, data):
+        with self._lock:
+            if path in self._blobs:
+                return
+            self._blobs[path] = data
+            self._blob_bytes += len(data)
+            while self._blob_bytes > self.memory_bytes and self._blobs:
+                _, evicted = self._blobs.popitem(last=False)
+                self._blob_bytes -= len(evicted)
+
+    def cached(self, path):
+        # байты файла из памяти или None, если их там нет
+        return self._blob(path)
+
+    def moved(self, src, dest):
+        # файл переименован (хранилище кладёт его под sha256) — байты в памяти остаются за новым путём
+        with self._lock:
+            data = self._blobs.pop(src, None)
+            if data is None:
+                return
+            self._blob_bytes -= len(data)
+        self._remember_blob(dest, data)
+
+    @contextmanager
+    def open(self, path):
+        # файл для send_* и InputMedia: маленький — BytesIO поверх общих байтов, большой — открытый файл.
+        # Дескриптор закрывается при выходе из with, даже если отправка упала
+        data = self._blob(path)
+        if data is None and os.path.getsize(path) <= self.small_file_bytes:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self._count('disk_reads')
+            self._remember_blob(path, data)
+
+        if data is not None:
+            # BytesIO не копирует байты, пока в него не пишут
+            media = io.BytesIO(data)
+            media.name = os.path.basename(path)
+        else:
+            media = open(path, 'rb')
+            self._count('disk_reads')
+        self._count('open_handles')
+        try:
+            yield media
+        finally:
+            media.close()
+            self._count('open_handles', -1)
+
+    def file_id(self, path):
+        with self._lock:
+            file_id = self._file_ids.get(path)
+            if file_id:
+                self._file_ids.move_to_end(path)
+                self.file_id_hits += 1
+            return file_id
+
+    def remember(self, path, file_id):
+        if not path or not file_id:
+            return
+        with self._lock:
+            self._file_ids[path] = file_id
+            self._file_ids.move_to_end(path)
+            while len(self._file_ids) > MAX_FILE_IDS:
+                self._file_ids.popitem(last=False)
+
+    def forget(self, path):
+        with self._lock:
+            self._file_ids.pop(path, None)
+
+    @contextmanager
+    def upload_lock(self, path):
+        # первую загрузку файла делает один поток, остальные ждут его file_id
+        with self._lock:
+            lock = self._upload_locks.setdefault(path, threading.Lock())
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                if not lock.locked():
+                    self._upload_locks.pop(path, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_handles': self.open_handles,
+                'memory_files': len(self._blobs),
+                'memory_bytes': self._blob_bytes,
+                'memory_hits': self.memory_hits,
+                'disk_reads': self.disk_reads,
+                'file_ids': len(self._file_ids),
+                'file_id_hits': self.file_id_hits,
+                'downloaded': self.downloaded,
+                'rejected': self.rejected,
+                'head_reads': self.head_reads,
+            }
+
@@ -0,0 +1,187 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib import request as urlrequest
+from urllib.error import HTTPError
+
+from telegram import Update
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY = 1024 * 1024
+
+logger = logging.getLogger('predlozhka.webhook')
+
+
+class WebhookServer:
+    # Принимает апдейты от Telegram по HTTP и складывает их в ограниченную очередь.
+    # Если очередь полна — отвечаем 503, и Telegram сам повторит доставку позже
+    def __init__(self, dispatcher, listen='127.0.0.1', port=8443, path='/telegram', secret_token=None,
+                 queue_size=1000):
+        self.dispatcher = dispatcher
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.updates = queue.Queue(maxsize=queue_size)
+
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected_full = 0
+        self.rejected_auth = 0
+        self.bad_requests = 0
+
+        self._httpd = None
+        self._threads = []
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, headers=None):
+                self.send_response(code)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+
+                if server.secret_token:
+                    given = self.headers.get(SECRET_HEADER, '')
+                    if not hmac.compare_digest(given.encode(), server.secret_token.encode()):
+                        server._count('rejected_auth')
+                        self._reply(403)
+                        return
+
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    if length <= 0 or length > MAX_BODY:
+                        raise ValueError('bad length')
+                    data = json.loads(self.rfile.read(length))
+                except ValueError:
+                    server._count('bad_requests')
+                    self._reply(400)
+                    return
+
+                try:
+                    server.updates.put_nowait(data)
+                except queue.Full:
+                    server._count('rejected_full')
+                    self._reply(503, {'Retry-After': '1'})
+                    return
+
+                server._count('accepted')
+                self._reply(200)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _pump(self):
+        while True:
+            data = self.updates.get()
+            if data is None:
+                break
+            try:
+                update = Update.de_json(data, self.dispatcher.bot)
+                self.dispatcher.process_update(update)
+            except Exception:
+                logger.exception('Update processing failed')
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.listen, self.port), self._make_handler())
+        for target in (self._httpd.serve_forever, self._pump):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def running(self):
+        return self._httpd is not None and all(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        self.updates.put(None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self.updates.qsize(),
+                'capacity': self.updates.maxsize,
+                'accepted': self.accepted,
+                'rejected_full': self.rejected_full,
+                'rejected_auth': self.rejected_auth,
+                'bad_requests': self.bad_requests,
+            }
+
+
+# ============================
+#   ЛОКАЛЬНЫЙ КЛИЕНТ ДЛЯ ТЕСТОВ
+# ============================
+
+class FakeTelegramClient:
+    # Шлёт апдейты в WebhookServer так же, как это делает Telegram
+    def __init__(self, url, secret_token=None):
+        self.url = url
+        self.secret_token = secret_token
+        self._update_id = 0
+        self._message_id = 0
+
+    def push(self, data):
+        headers = {'Content-Type': 'application/json'}
+        if self.secret_token:
+            headers[SECRET_HEADER] = self.secret_token
+        req = urlrequest.Request(self.url, data=json.dumps(data).encode(), headers=headers, method='POST')
+        try:
+            with urlrequest.urlopen(req, timeout=10) as resp:
+                return resp.status
+        except HTTPError as e:
+            return e.code
+
+    def message(self, user_id, text=None, first_name='Test', **fields):
+        self._update_id += 1
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0,
+                                        'length': len(text.split()[0])}]
+        message.update(fields)
+        return {'update_id': self._update_id, 'message': message}
+
+    def callback(self, user_id, data, message_id=1, first_name='Test'):
+        # нажатие инлайн-кнопки под сообщением message_id в личке с ботом
+        self._update_id += 1
+        user = {'id': user_id, 'is_bot': False, 'first_name': first_name}
+        query = {
+            'id': str(self._update_id),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {'message_id': message_id, 'date': 0,
+                        'chat': {'id': user_id, 'type': 'private', 'first_name': first_name}},
+        }
+        return {'update_id': self._update_id, 'callback_query': query}
+
+    def send_message(self, user_id, text=None, **fields):
+        return self.push(self.message(user_id, text, **fields))
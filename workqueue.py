@@ -0,0 +1,224 @@
+import os
+import json
+import socket
+import datetime
+import logging
+import threading
+
+from sqlalchemy import exists, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from sqlhelper import QueuedUpdate
+
+# на сколько секунд воркер забирает апдейты; пока он работает, аренда продлевается после каждого апдейта
+LEASE = 120
+BATCH = 20
+# как часто свободный поток воркера заглядывает в очередь
+POLL = 0.5
+# после стольких выдач апдейт, на котором воркеры падают, откладывается с ошибкой
+MAX_ATTEMPTS = 5
+# через сколько секунд апдейт, на котором упал обработчик, выдаётся снова
+RETRY_DELAY = 15
+
+logger = logging.getLogger('predlozhka.workqueue')
+
+
+def update_key(update):
+    # апдейты одного пользователя обрабатываются одним воркером и по порядку: части альбома, /start и пост
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return 0
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+class WorkQueue:
+    # Очередь апдейтов в базе между процессом приёма (ingress) и воркерами.
+    # Воркер берёт апдейты в аренду: если он упал, аренда истекает и апдейты достаются другому.
+    # Аренда держится за пользователем (key) и после обработки, пока не истечёт: новые апдейты
+    # этого пользователя забирает тот же воркер, поэтому части альбома не разъезжаются по процессам
+    def __init__(self, lease=LEASE, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.duplicates = 0
+        self.claimed = 0
+        self.completed = 0
+        self.retried = 0
+        self.dead = 0
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def put(self, db, update):
+        db.add(QueuedUpdate(update.update_id, update_key(update), update.to_json()))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Telegram прислал апдейт повторно (например, ingress упал до подтверждения offset)
+            db.rollback()
+            self._count('duplicates')
+            return False
+        self._count('enqueued')
+        return True
+
+    def claim(self, db, owner, limit=BATCH):
+        # апдейты, взятые в аренду owner, по порядку поступления
+        now = _now()
+        expired = or_(QueuedUpdate.lease_until.is_(None), QueuedUpdate.lease_until < now)
+
+        dead = db.query(QueuedUpdate) \
+            .filter(QueuedUpdate.done.is_(False), expired, QueuedUpdate.attempts >= self.max_attempts) \
+            .update({'done': True, 'error': 'gave up after {} attempts'.format(self.max_attempts)},
+                    synchronize_session=False)
+        if dead:
+            logger.error('%s queued updates failed %s times and were dropped', dead, self.max_attempts)
+            self._count('dead', dead)
+
+        other = aliased(QueuedUpdate)
+        held_by_other = exists().where(other.key == QueuedUpdate.key, other.lease_owner != owner,
+                                       other.lease_until >= now)
+        # более ранний апдейт пользователя ещё в работе или ждёт повтора — этот только после него
+        earlier = aliased(QueuedUpdate)
+        waits_for_earlier = exists().where(earlier.key == QueuedUpdate.key, earlier.id < QueuedUpdate.id,
+                                           earlier.done.is_(False), earlier.lease_until >= now)
+        free = (QueuedUpdate.done.is_(False), expired, ~held_by_other, ~waits_for_earlier)
+
+        ids = [r.id for r in db.query(QueuedUpdate.id).filter(*free).order_by(QueuedUpdate.id).limit(limit)]
+        if not ids:
+            db.commit()
+            return []
+
+        # условие повторяется в UPDATE: между SELECT и UPDATE часть апдейтов мог забрать другой воркер
+        until = now + datetime.timedelta(seconds=self.lease)
+        db.query(QueuedUpdate).filter(QueuedUpdate.id.in_(ids), *free) \
+            .update({'lease_owner': owner, 'lease_until': until, 'attempts': QueuedUpdate.attempts + 1},
+                    synchronize_session=False)
+        db.commit()
+
+        rows = db.query(QueuedUpdate) \
+            .filter(QueuedUpdate.id.in_(ids), QueuedUpdate.lease_owner == owner, QueuedUpdate.lease_until == until) \
+            .order_by(QueuedUpdate.id).all()
+        self._count('claimed', len(rows))
+        return rows
+
+    def complete(self, db, row, owner, error=None):
+        # апдейт готов; аренду остальных апдейтов этого воркера продлеваем — он жив и работает
+        until = _now() + datetime.timedelta(seconds=self.lease)
+        db.query(QueuedUpdate).filter_by(id=row.id).update({'done': True, 'error': error}, synchronize_session=False)
+        db.query(QueuedUpdate).filter(QueuedUpdate.lease_owner == owner, QueuedUpdate.done.is_(False)) \
+            .update({'lease_until': until}, synchronize_session=False)
+        db.commit()
+        self._count('completed')
+
+    def fail(self, db, row, owner, error):
+        # Обработчик упал: апдейт вернётся в очередь через retry_delay секунд, и его возьмёт любой воркер.
+        # Следующие апдейты пользователя из аренды owner отпускаются вместе с ним, чтобы не обогнать его.
+        # После max_attempts выдач апдейт откладывается с ошибкой (см. claim)
+        until = _now() + datetime.timedelta(seconds=self.retry_delay)
+        db.query(QueuedUpdate).filter_by(id=row.id) \
+            .update({'error': error, 'lease_owner': None, 'lease_until': until}, synchronize_session=False)
+        # их не обрабатывали — попытка им не засчитывается
+        db.query(QueuedUpdate) \
+            .filter(QueuedUpdate.key == row.key, QueuedUpdate.id > row.id, QueuedUpdate.done.is_(False),
+                    QueuedUpdate.lease_owner == owner) \
+            .update({'lease_owner': None, 'lease_until': until, 'attempts': QueuedUpdate.attempts - 1},
+                    synchronize_session=False)
+        db.commit()
+        self._count('retried')
+
+    def purge(self, db):
+        # готовые апдейты с истёкшей арендой больше ничего не держат; отложенные с ошибкой оставляем для разбора
+        removed = db.query(QueuedUpdate) \
+            .filter(QueuedUpdate.done.is_(True), QueuedUpdate.error.is_(None), QueuedUpdate.lease_until < _now()) \
+            .delete(synchronize_session=False)
+        db.commit()
+        return removed
+
+    def stats(self, db):
+        waiting = db.query(QueuedUpdate).filter(QueuedUpdate.done.is_(False)).count()
+        failed = db.query(QueuedUpdate).filter(QueuedUpdate.done.is_(True), QueuedUpdate.error.isnot(None)).count()
+        with self._lock:
+            return {
+                'waiting': waiting,
+                'failed': failed,
+                'enqueued': self.enqueued,
+                'duplicates': self.duplicates,
+                'claimed': self.claimed,
+                'completed': self.completed,
+                'retried': self.retried,
+                'dead': self.dead,
+            }
+
+
+class QueueConsumer:
+    # Потоки воркера: каждый берёт пачку апдейтов в аренду и прогоняет их через process(data) по одному.
+    # Владелец аренды — хост, pid и номер потока, поэтому апдейты пользователя идут в одном потоке по порядку
+    def __init__(self, work_queue, session_factory, process, threads=8, batch=BATCH, poll=POLL):
+        self.queue = work_queue
+        self._session_factory = session_factory
+        self._process = process
+        self.threads = threads
+        self.batch = batch
+        self.poll = poll
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _owner(self, index):
+        return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), index)
+
+    def _run(self, index):
+        owner = self._owner(index)
+        while not self._stop.is_set():
+            rows = []
+            # пользователи, чей апдейт в этой пачке упал: остальные их апдейты ждут повтора
+            failed = set()
+            db = self._session_factory()
+            try:
+                rows = self.queue.claim(db, owner, self.batch)
+                for row in rows:
+                    if self._stop.is_set():
+                        # недоделанные апдейты достанутся другому воркеру, когда истечёт аренда
+                        break
+                    if row.key in failed:
+                        continue
+                    try:
+                        self._process(json.loads(row.payload))
+                    except Exception as e:
+                        # упал обработчик (база занята, сеть при getFile) или апдейт битый — повторим позже
+                        logger.exception('Queued update %s failed', row.update_id)
+                        failed.add(row.key)
+                        self.queue.fail(db, row, owner, str(e)[:500])
+                        continue
+                    self.queue.complete(db, row, owner)
+            except Exception:
+                logger.exception('Work queue poll failed')
+                db.rollback()
+            finally:
+                db.close()
+            if not rows:
+                self._stop.wait(self.poll)
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._run, args=(index,), name='queue-{}'.format(index), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def running(self):
+        return not self._stop.is_set() and any(thread.is_alive() for thread in self._threads)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)